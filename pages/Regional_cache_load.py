@@ -1,127 +1,67 @@
 import streamlit as st
-import pandas as pd
 import datetime
-import json
-from pymongo import MongoClient
-from plotly.subplots import make_subplots
 
-st.set_page_config(page_title="Steam cache load per region", page_icon=":video_game:", layout="wide")
+from steamgraphs.availability import DOWN_LOAD
+from steamgraphs.bootstrap import page
+from steamgraphs.cache_load import load_distribution, mean_region_cache_loads
+from steamgraphs.cells import CELLS
+from steamgraphs.figures import figure_spec, show_figure
 
-cell_id_to_region = {}
-with open('CellMap.json', 'r', encoding='utf-8') as file:
-    cid_to_region = json.load(file)
-    cell_id_to_region = {int(k): v for k, v in cid_to_region.items()}
+bounds = page("Steam cache load per region")
 
-cm_cache_detail = [{
-        'cell_id': int(k),
-        'cm': v['cm'],
-        'cache': v['cache'],
-        'code': v['code'],
-        'region': v['region'],
-        'city': v['city']
-    } for k, v in cell_id_to_region.items()]
-
-region_to_city = {x['region']: set() for x in cm_cache_detail}
-
-for x in cm_cache_detail:
-    if x['cache'] != '':
-        region_to_city[x['region']].add(x['city'])
-
-region_to_city = {k: list(v) for k, v in region_to_city.items()}
-
-@st.cache_resource
-def init_connection():
-
-    return MongoClient(**st.secrets["mongo"])
+now = datetime.datetime.utcnow()
 
-client = init_connection()
+def mean_cache_load_graph(region, start, end, overlay_traffic=False, full_resolution=False, down_load=DOWN_LOAD, key=None):
+    spec = figure_spec('mean_load', region, start, end, overlay_traffic, full_resolution, down_load)
+    if spec is None:
+        st.error('No data found for given timeframe')
+    else:
+        show_figure(spec, key)
 
-@st.cache_data(ttl=600)
-def get_data():
-    db = client.steam
-    items = db.global_bandwidth.find({},{'_id': 0})
-    items = list(items)  # make hashable for st.cache_data
-    return items
 
-all_df = pd.DataFrame(get_data())
-all_df.set_index('timestamp', inplace=True)
-all_df.sort_index(inplace=True)
+def load_distribution_metrics(total):
+    cols = st.columns(4)
+    cols[0].metric('Median load', f"{total['p50']:.1f}")
+    cols[1].metric('95th percentile', f"{total['p95']:.1f}")
+    cols[2].metric('Maximum load', f"{total['max']:.1f}")
+    cols[3].metric('Caches above 100', int(total['hosts_over']))
 
-colnames = list(all_df.columns)
-now = datetime.datetime.utcnow()
-
-@st.cache_data(ttl=1800)
-def mean_region_cache_load(start, end, region):
-    region = region.replace(' ', '_')
-    db = client.steam
-    start = datetime.datetime.combine(start, datetime.time())
-    end = datetime.datetime.combine(end, datetime.time()) + datetime.timedelta(days=1)
-    items = list(db.cache.find({'timestamp': {"$gte": start, "$lte": end}, 'region': region, 'type': 'SteamCache'},{'timestamp': 1, 'host': 1, 'load': 1, '_id': 0}))
-    df = pd.DataFrame(items)
-    df = df.groupby(['timestamp', 'host'])['load'].mean().unstack().fillna(100)
-    return df
-
-@st.cache_data(ttl=1800)
-def mean_regions_cache_load(start, end):
-    db = client.steam
-    start = datetime.datetime.combine(start, datetime.time())
-    end = datetime.datetime.combine(end, datetime.time()) + datetime.timedelta(days=1)
-    items = list(db.cache.find({'timestamp': {"$gte": start, "$lte": end}},{'_id': 0, 'time_stamp': 0, 'rounded_timestamp': 0}))
-    df = pd.DataFrame(items)
-    df = df.groupby(['timestamp', 'region'])['load'].mean().unstack().fillna(100)
-    return df
-
-@st.cache_data(ttl=1800)
-def mean_cache_load_graph(df, overlay_traffic=False, traffic_df=None, region=None):
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
-    dates = df.index.unique()
-
-    if overlay_traffic:
-        region_traffic = traffic_df[region.replace(' ', '_')]
-        region_traffic_filtered = region_traffic[region_traffic.index.isin(dates)]
-        df.sort_index(inplace=True)
-        region_traffic_filtered.sort_index(inplace=True)
-        fig.add_scatter(x=df.index, y=df.mean(axis=1), mode='lines', name=f'Mean Cache load')
-        fig.add_scatter(x=region_traffic_filtered.index, y=region_traffic_filtered, mode='lines', name=f'Mean Traffic for {region}', secondary_y=True)
-    else:
-        fig.add_scatter(x=df.index, y=df.mean(axis=1), mode='lines', name='Mean Cache Load')
-
-    fig.update_layout(
-        title=f'Mean Cache Load for {region}',
-        xaxis_title='Date',
-        yaxis_title='Cache Server load',
-        xaxis_tickformat='%y-%m-%d %H',
-        yaxis_range=[0, 120],
-        xaxis_range=[df.index[0], df.index[-1] + datetime.timedelta(minutes=10)],
-        showlegend=True,
-        legend_title_text='Hosts',
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1,
-        ),
-        height=600,
-    )
-    st.plotly_chart(fig, use_container_width=True)
 
 st.header('Regional Cache Load')
-txt = "This page shows the mean cache load for a region. The mean cache load is calculated by taking the mean of the cache load for all caches in the region. When a cache is no longer available it is assumed to have a load of 100. The graph can be overlayed with the regional traffic data to see if there is a correlation between the cache load and the traffic."
+txt = "This page shows the mean cache load for a region. The mean cache load is calculated by taking the mean of the cache load for all caches in the region. When a cache is no longer available it is assumed to have a load of 100, unless unavailable caches are excluded from the mean. The graph can be overlayed with the regional traffic data to see if there is a correlation between the cache load and the traffic."
 st.markdown(txt)
+if bounds is None:
+    st.error('No traffic data has been collected yet.')
+    st.stop()
+first, last, _ = bounds
 
 st.subheader("Mean Cache Load")
-cache_regions = list(set(x['region'].replace('_', ' ') for x in cm_cache_detail if x['cache']))
+cache_regions = [r.replace('_', ' ') for r in CELLS.cache_regions]
 col1, col2, col3 = st.columns(3)
 with col1:
     region = st.selectbox('Select region', cache_regions, key="mean_load_region")
 with col2:
-    start = st.date_input('Start data', value=all_df.index[-1] - datetime.timedelta(hours=48), min_value=all_df.index[0].to_pydatetime(), max_value=all_df.index[-1].to_pydatetime(), key="mean_load_start")
+    start = st.date_input('Start data', value=max(first, last - datetime.timedelta(hours=48)), min_value=first, max_value=last, key="mean_load_start")
 with col3:
-    end = st.date_input('End data', value=all_df.index[-1], min_value=all_df.index[0].to_pydatetime(), max_value=all_df.index[-1].to_pydatetime(), key="mean_load_end")
-overlay_traffic = st.toggle('Overlay regional traffic data', False, key="mean_load_overlay")
-mean_load = mean_region_cache_load(start, end, region)
-mean_cache_load_graph(mean_load, overlay_traffic, all_df, region)
+    end = st.date_input('End data', value=last, min_value=first, max_value=last, key="mean_load_end")
+toggle1, toggle2, toggle3 = st.columns(3)
+with toggle1:
+    overlay_traffic = st.toggle('Overlay regional traffic data', False, key="mean_load_overlay")
+with toggle2:
+    full_resolution = st.toggle('Show full resolution', False, key="mean_load_full_resolution")
+with toggle3:
+    exclude_down = st.toggle('Exclude unavailable caches', False, key="mean_load_exclude_down")
+down_load = None if exclude_down else DOWN_LOAD
+mean_cache_load_graph(region, start, end, overlay_traffic, full_resolution, down_load)
+
+st.subheader("Load distribution")
+st.markdown("The mean hides caches running hot. These are the percentiles and the maximum of the load of all caches in the region, per hour (per day over long ranges), and how many caches went above 100.")
+buckets, total = load_distribution(start, end, region=region)
+if buckets.empty:
+    st.warning('No cache load found for this timeframe.')
+else:
+    load_distribution_metrics(total)
+    show_figure(figure_spec('load_distribution', region, start, end))
 
 
 all_col, region_col = st.columns(2)
@@ -133,17 +73,16 @@ with region_col:
 
 if show_all:
     st.header("Mean cache load for all regions")
+    mean_region_cache_loads(start, end, cache_regions, down_load)
     for r in cache_regions:
         st.header('Cache Load for ' + r)
-        mean_load = mean_region_cache_load(start, end, r)
         overlay_t = st.toggle('Overlay regional traffic data', False, key=f"mean_load_overlay_{cache_regions.index(r)}")
-        mean_cache_load_graph(mean_load, overlay_t, all_df, r)
+        mean_cache_load_graph(r, start, end, overlay_t, full_resolution, down_load, key=f"mean_load_chart_{cache_regions.index(r)}")
 
 
 if add_region:
     reg = st.selectbox('Select region', cache_regions, key="mean_load_add_region_select", index=None)
     if reg:
         st.header("Mean cache load for " + reg)
-        mean_load = mean_region_cache_load(start, end, reg)
         overlay = st.toggle('Overlay regional traffic data', False, key="mean_load_overlay_add")
-        mean_cache_load_graph(mean_load, overlay, all_df, reg)
+        mean_cache_load_graph(reg, start, end, overlay, full_resolution, down_load, key="mean_load_chart_add")
@@ -0,0 +1,48 @@
+import streamlit as st
+import pandas as pd
+import datetime
+
+from steamgraphs.bootstrap import page
+from steamgraphs.correlation import region_correlation
+from steamgraphs.figures import figure_spec, show_figure
+
+bounds = page("Steam traffic and cache load correlation")
+
+
+st.header('Traffic and cache load correlation')
+txt = ("This page compares the traffic of every region with the mean load of its caches. The rolling correlation "
+       "shows when cache load moved together with traffic (blue) or against it (red). The lag is the shift between "
+       "the two series with the strongest correlation; a positive lag means the cache load follows the traffic.")
+st.markdown(txt)
+if bounds is None:
+    st.error('No traffic data has been collected yet.')
+    st.stop()
+first, last, _ = bounds
+col1, col2 = st.columns(2)
+with col1:
+    start = st.date_input('Start data', value=max(first, last - datetime.timedelta(days=7)), min_value=first, max_value=last, key="correlation_start")
+with col2:
+    end = st.date_input('End data', value=last, min_value=first, max_value=last, key="correlation_end")
+if start > end:
+    st.error('Start date must be before end date.')
+    st.stop()
+
+_, _, lags = region_correlation(start, end)
+if lags.empty:
+    st.error('No data found for given timeframe')
+    st.stop()
+
+st.subheader('Rolling correlation')
+show_figure(figure_spec('rolling_correlation', start, end))
+
+st.subheader('Lag between traffic and cache load')
+lag_col, table_col = st.columns([2, 1])
+with lag_col:
+    show_figure(figure_spec('lag_profile', start, end))
+with table_col:
+    table = pd.DataFrame({
+        'Lag (minutes)': lags['lag'] / datetime.timedelta(minutes=1),
+        'Correlation': lags['correlation'].round(2),
+        'Samples': lags['samples'],
+    }, index=lags.index.str.replace('_', ' '))
+    st.dataframe(table, use_container_width=True)
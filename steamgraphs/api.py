@@ -0,0 +1,300 @@
+"""Read-only HTTP/JSON API over the dashboard's aggregated series.
+
+Other consumers get the same regional traffic, cache load and heatmap
+data as the pages, through the same query functions and caches, instead
+of scraping the dashboard or querying Mongo themselves::
+
+    GET /bounds
+    GET /traffic?start=2024-02-01&end=2024-02-08
+    GET /cache_load/region?region=Europe&start=...&end=...[&exclude_unavailable=1]
+    GET /cache_load/city?city=Frankfurt&start=...&end=...
+    GET /heatmap?region=Europe&start=...&end=...
+
+Dates are inclusive calendar days, as in the date inputs of the pages:
+every endpoint returns the samples in ``[start 00:00, end + 1 day 00:00)``.
+Each response also names its resolution, which is chosen from the span
+the same way the charts choose it. Series are columnar, one array per
+column with ``timestamp`` first and ``null`` for missing values. Bodies
+are gzip-compressed when the client accepts it.
+
+A response is rendered once per query and kept in the Streamlit cache
+and, when ``STEAMGRAPHS_SHARED_CACHE`` names a store, across processes.
+Every response has an ``ETag``. A poll repeating ``If-None-Match`` gets
+``304 Not Modified``, and neither that answer nor a repeated ``200``
+touches Mongo while the entry is cached. ``Cache-Control`` lets shared
+HTTP caches keep ranges whose days are all final (see
+``steamgraphs.range_cache.SETTLE``) for a day and others for ``API_TTL``
+seconds.
+
+Serve the configured database, a local mongod or generated data in
+mongomock::
+
+    python -m steamgraphs.api --port 8502
+    python -m steamgraphs.api --mongo-uri mongodb://localhost:27017
+    python -m steamgraphs.api --synthetic-days 3
+"""
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import sys
+import traceback
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+import streamlit.logger
+
+from steamgraphs.availability import DOWN_LOAD
+from steamgraphs.cache_load import city_load, mean_load_frame, mean_region_cache_load
+from steamgraphs.cells import CELLS
+from steamgraphs.db import use_database
+from steamgraphs.heatmap import cache_city_query
+from steamgraphs.instrument import record_miss, timed
+from steamgraphs.range_cache import DAY, first_unsettled_day
+from steamgraphs.rollups import resolution_for
+from steamgraphs.shared_cache import get_or_compute, shared_backend
+from steamgraphs.traffic import traffic_bounds, traffic_range
+
+API_TTL = 600
+PAST_MAX_AGE = 86400
+DECIMALS = 3
+
+
+class BadRequest(ValueError):
+    """A query parameter is missing or invalid."""
+
+
+def _param(query, name, required=True):
+    values = query.get(name)
+    if not values:
+        if required:
+            raise BadRequest(f'missing parameter {name!r}')
+        return None
+    return values[-1]
+
+
+def _dates(query):
+    start, end = _param(query, 'start'), _param(query, 'end')
+    try:
+        start, end = datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+    except ValueError:
+        raise BadRequest('start and end must be dates as YYYY-MM-DD') from None
+    if start > end:
+        raise BadRequest('start must not be after end')
+    return start, end
+
+
+def _region(query):
+    region = _param(query, 'region').replace(' ', '_')
+    if region not in CELLS.cache_regions:
+        raise BadRequest(f'unknown region; one of {", ".join(r.replace("_", " ") for r in CELLS.cache_regions)}')
+    return region
+
+
+def _city(query):
+    city = _param(query, 'city')
+    if city not in CELLS.cache_cities:
+        raise BadRequest('unknown city; see the cities of /bounds')
+    return city
+
+
+def _flag(query, name):
+    return (_param(query, name, required=False) or '').lower() in ('1', 'true', 'yes')
+
+
+def _span(start, end):
+    """``(start, stop, resolution)``: the half-open datetime range of the days ``start`` to ``end``."""
+    start_at = datetime.datetime.combine(start, datetime.time())
+    return start_at, datetime.datetime.combine(end, datetime.time()) + DAY, resolution_for(start, end)
+
+
+def columns(df):
+    """Columnar form of a frame indexed by timestamp: ``{'timestamp': [...], column: [...]}``."""
+    out = {'timestamp': pd.DatetimeIndex(df.index).strftime('%Y-%m-%dT%H:%M:%S').tolist()}
+    for name in df.columns:
+        values = df[name].to_numpy(dtype='float64').round(DECIMALS)
+        out[str(name).replace('_', ' ')] = [None if np.isnan(v) else v for v in values.tolist()]
+    return out
+
+
+def _bounds():
+    bounds = traffic_bounds()
+    first, last, regions = bounds if bounds is not None else (None, None, [])
+    return {
+        'first': first and first.isoformat(),
+        'last': last and last.isoformat(),
+        'traffic_regions': [r.replace('_', ' ') for r in regions],
+        'cache_regions': [r.replace('_', ' ') for r in CELLS.cache_regions],
+        'cities': list(CELLS.cache_cities),
+    }
+
+
+def _traffic(start, end):
+    start, stop, resolution = _span(start, end)
+    df = traffic_range(start, stop, resolution)
+    return {'data': columns(df[df.index < stop] if not df.empty else df)}
+
+
+def _region_load(region, start, end, exclude_unavailable):
+    _, stop, resolution = _span(start, end)
+    load = mean_region_cache_load(start, end, region, None if exclude_unavailable else DOWN_LOAD, resolution)
+    load = load[load.index < stop]
+    return {'region': region.replace('_', ' '), 'data': columns(load.sort_index().to_frame('load'))}
+
+
+def _city_load(city, start, end):
+    _, stop, resolution = _span(start, end)
+    rows, _, _, down = city_load(city, start, end + DAY, resolution)
+    # ``city_load`` also takes the sample at ``stop``; drop it, and end the
+    # down intervals reaching it at the last sample before.
+    rows = rows[rows['timestamp'] < stop]
+    down = down[down['start'] < stop]
+    if not rows.empty:
+        down = down.assign(end=down['end'].clip(upper=rows['timestamp'].max()))
+    return {
+        'city': city,
+        'data': columns(mean_load_frame(rows, 'host').sort_index()),
+        'down': {
+            'host': down['host'].astype(str).tolist(),
+            'start': pd.DatetimeIndex(down['start']).strftime('%Y-%m-%dT%H:%M:%S').tolist(),
+            'end': pd.DatetimeIndex(down['end']).strftime('%Y-%m-%dT%H:%M:%S').tolist(),
+        },
+    }
+
+
+def _heatmap(region, start, end):
+    # The midnight sample after the range is past the stop.
+    df = cache_city_query(start, end, next_midnight=False).get(region)
+    if df is None:
+        return {'region': region.replace('_', ' '), 'cache_cities': [], 'origins': [], 'counts': []}
+    return {
+        'region': region.replace('_', ' '),
+        'cache_cities': df.index.tolist(),
+        'origins': df.columns.tolist(),
+        'counts': df.to_numpy().round().astype(np.int64).tolist(),
+    }
+
+
+# Path -> (read the query into hashable arguments, build the payload from them).
+ENDPOINTS = {
+    '/bounds': (lambda query: (), _bounds),
+    '/traffic': (_dates, _traffic),
+    '/cache_load/region': (lambda query: (_region(query), *_dates(query), _flag(query, 'exclude_unavailable')),
+                           _region_load),
+    '/cache_load/city': (lambda query: (_city(query), *_dates(query)), _city_load),
+    '/heatmap': (lambda query: (_region(query), *_dates(query)), _heatmap),
+}
+
+
+def render(path, args):
+    """``(etag, gzipped JSON body, max_age)`` of an endpoint for parsed arguments."""
+    payload = ENDPOINTS[path][1](*args)
+    dates = [a for a in args if isinstance(a, datetime.date)]
+    if dates:
+        payload = {'start': dates[0].isoformat(), 'end': dates[-1].isoformat(),
+                   'resolution': resolution_for(dates[0], dates[-1]), **payload}
+    body = json.dumps(payload, separators=(',', ':'), allow_nan=False).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    max_age = PAST_MAX_AGE if dates and dates[-1] < first_unsettled_day() else API_TTL
+    return etag, gzip.compress(body, 6), max_age
+
+
+@timed()
+@st.cache_data(ttl=API_TTL, show_spinner=False)
+@record_miss
+def response(path, args):
+    """``render`` cached in-process and, when configured, in the shared store."""
+    shared = shared_backend()
+    if shared is None:
+        return render(path, args)
+    return get_or_compute(shared, f'api:{path}:{args!r}', lambda: render(path, args), API_TTL)
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'steamgraphs-api'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path not in ENDPOINTS:
+            self._send_error(HTTPStatus.NOT_FOUND, f'unknown endpoint; one of {", ".join(ENDPOINTS)}')
+            return
+        try:
+            args = ENDPOINTS[url.path][0](parse_qs(url.query))
+        except BadRequest as error:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(error))
+            return
+        try:
+            etag, body, max_age = response(url.path, args)
+        except Exception as error:
+            self.log_error('%s failed: %r', self.path, error)
+            traceback.print_exc()
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, 'internal error')
+            return
+        if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._cache_headers(etag, max_age)
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self._cache_headers(etag, max_age)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self.send_header('Content-Encoding', 'gzip')
+        else:
+            body = gzip.decompress(body)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _cache_headers(self, etag, max_age):
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', f'public, max-age={max_age}')
+        self.send_header('Vary', 'Accept-Encoding')
+
+    def _send_error(self, status, message):
+        body = json.dumps({'error': message}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--mongo-uri', help='serve the steam database of this server instead of the configured one')
+    source.add_argument('--synthetic-days', type=float,
+                        help='serve this many days of generated data from mongomock')
+    args = parser.parse_args(argv)
+    # Cached functions warn about the missing Streamlit runtime on every call.
+    streamlit.logger.set_log_level('error')
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        use_database(MongoClient(args.mongo_uri).steam)
+    elif args.synthetic_days:
+        from steamgraphs.bench import generate, open_database
+        from steamgraphs.rollups import update_rollups
+        db = open_database()
+        generate(db, args.synthetic_days / 30)
+        update_rollups(db)
+        use_database(db)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f'Serving on http://{args.host}:{server.server_port}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
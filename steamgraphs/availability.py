@@ -0,0 +1,78 @@
+"""Host availability as run-length intervals over the sample grid.
+
+A host is up at a sample time when it reported a load then, and down
+otherwise (including before its first and after its last report in the
+range). Instead of a dense timestamps × hosts matrix filled with
+placeholder loads, ``host_intervals`` encodes each host as alternating up
+and down runs, and ``mean_load`` averages the reported loads directly,
+with down hosts either counted at ``DOWN_LOAD`` or left out.
+"""
+import numpy as np
+import pandas as pd
+
+DOWN_LOAD = 100
+COLUMNS = ['host', 'up', 'start', 'end', 'samples']
+
+
+def host_intervals(timestamps, hosts, grid=None):
+    """Up and down runs of every host; ``start`` and ``end`` are inclusive grid times.
+
+    ``grid`` is the sorted sample times to judge availability on and
+    defaults to every distinct time in ``timestamps``.
+    """
+    timestamps = np.asarray(timestamps)
+    grid = np.unique(timestamps) if grid is None else np.asarray(grid)
+    if len(timestamps) == 0 or len(grid) == 0:
+        return pd.DataFrame(columns=COLUMNS)
+    n = len(grid)
+    host_code, host_names = pd.factorize(np.asarray(hosts))
+    observed = np.unique(host_code.astype(np.int64) * n + np.searchsorted(grid, timestamps))
+    host, position = np.divmod(observed, n)
+
+    # Runs of consecutive grid positions per host are the up intervals.
+    starts = np.flatnonzero(np.r_[True, (host[1:] != host[:-1]) | (position[1:] != position[:-1] + 1)])
+    ends = np.r_[starts[1:], len(observed)] - 1
+    run_host, first, last = host[starts], position[starts], position[ends]
+
+    # Down intervals fill the gaps between a host's runs and the range edges.
+    same = run_host[1:] == run_host[:-1]
+    is_first = np.r_[True, ~same]
+    is_last = np.r_[~same, True]
+    lead = is_first & (first > 0)
+    trail = is_last & (last < n - 1)
+    down_host = np.concatenate([run_host[:-1][same], run_host[lead], run_host[trail]])
+    down_first = np.concatenate([last[:-1][same] + 1, np.zeros(lead.sum(), dtype=np.int64), last[trail] + 1])
+    down_last = np.concatenate([first[1:][same] - 1, first[lead] - 1, np.full(trail.sum(), n - 1)])
+
+    all_host = np.concatenate([run_host, down_host])
+    all_first = np.concatenate([first, down_first])
+    all_last = np.concatenate([last, down_last])
+    order = np.lexsort((all_first, all_host))
+    return pd.DataFrame({
+        'host': np.asarray(host_names)[all_host[order]],
+        'up': np.r_[np.ones(len(run_host), dtype=bool), np.zeros(len(down_host), dtype=bool)][order],
+        'start': grid[all_first[order]],
+        'end': grid[all_last[order]],
+        'samples': (all_last - all_first + 1)[order],
+    })
+
+
+def down_intervals(intervals):
+    return intervals[~intervals['up'].astype(bool)].reset_index(drop=True)
+
+
+def mean_load(rows, key='host', down_load=DOWN_LOAD):
+    """Mean ``load`` per timestamp over every ``key`` seen in ``rows``.
+
+    A host without a row at a timestamp is counted with ``down_load``;
+    ``None`` averages only the hosts that reported.
+    """
+    if rows.empty:
+        return pd.Series(dtype='float64', name='load')
+    totals = rows.groupby('timestamp')['load'].agg(['sum', 'count'])
+    if down_load is None:
+        mean = totals['sum'] / totals['count']
+    else:
+        hosts = rows[key].nunique()
+        mean = (totals['sum'] + down_load * (hosts - totals['count'])) / hosts
+    return mean.rename('load')
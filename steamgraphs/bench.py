@@ -0,0 +1,214 @@
+"""Benchmarks of every page's data path on synthetic data, without Streamlit.
+
+A deterministic generator fills ``global_bandwidth`` and ``cache`` with
+10-minute samples for a configurable history length, number of hosts per
+cache city and top-N cache list per query. The data goes into mongomock
+by default (``pip install mongomock``, it is not an app dependency) or
+into a throwaway database on a local mongod::
+
+    python -m steamgraphs.bench --months 0.25 1 3 --output bench.json
+    python -m steamgraphs.bench --mongo-uri mongodb://localhost:27017 --rollups
+
+Every data function is timed cold (all caches cleared) and warm, and its
+peak traced memory is recorded, over the last two days and over the full
+history. The report is written as JSON. mongomock runs aggregations in
+Python, so compare cold timings only within one backend.
+"""
+import argparse
+import datetime
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+import streamlit.logger
+
+from steamgraphs.cache_load import city_load, mean_region_cache_load, mean_regions_cache_load
+from steamgraphs.cells import CELLS
+from steamgraphs.db import use_database
+from steamgraphs.heatmap import TOP_N, cache_city_query
+from steamgraphs.rollups import update_rollups
+from steamgraphs.traffic import get_traffic_data_date, traffic_range
+
+SAMPLE_INTERVAL = datetime.timedelta(minutes=10)
+END = datetime.datetime(2024, 3, 1)
+BENCH_DATABASE = 'steam_bench'
+INSERT_BATCH = 10_000
+RECENT = datetime.timedelta(days=2)
+
+
+def generate(db, months=1.0, hosts_per_city=2, top_n=TOP_N, queries=4, seed=0, end=END):
+    """Fill ``db`` with ``months`` of samples ending at ``end``; returns document counts.
+
+    Every sample has one ``global_bandwidth`` document and, for ``queries``
+    origin cells, the ``top_n`` ranked caches with each of their hosts. The
+    same arguments always produce the same documents.
+    """
+    rng = np.random.default_rng(seed)
+    regions = list(CELLS.by_region) + ['Global']
+    origins = [c.cell_id for c in CELLS.cells]
+    caches = list(CELLS.by_cache.values())
+    hosts = {c.cache: [f'cache{h}-{c.cache}.steamcontent.com' for h in range(hosts_per_city)] for c in caches}
+    samples = int(months * 30 * datetime.timedelta(days=1) / SAMPLE_INTERVAL)
+    start = end - samples * SAMPLE_INTERVAL
+
+    counts = {'global_bandwidth': 0, 'cache': 0}
+    traffic, cache = [], []
+    for i in range(samples):
+        timestamp = start + i * SAMPLE_INTERVAL
+        traffic.append({'timestamp': timestamp, **dict(zip(regions, rng.uniform(0, 100, len(regions)).tolist()))})
+        for query_id in rng.choice(origins, queries, replace=False).tolist():
+            for index in rng.choice(len(caches), min(top_n, len(caches)), replace=False).tolist():
+                cell = caches[index]
+                for h, host in enumerate(hosts[cell.cache]):
+                    if rng.random() < 0.05:
+                        continue
+                    cache.append({
+                        'timestamp': timestamp,
+                        'query_id': query_id,
+                        'city': cell.city,
+                        'region': cell.region,
+                        'host': host,
+                        'load': int(rng.integers(0, 101)),
+                        'type': 'SteamCache' if h == 0 or rng.random() < 0.8 else 'CDN',
+                    })
+        if len(cache) >= INSERT_BATCH or i == samples - 1:
+            for name, docs in (('global_bandwidth', traffic), ('cache', cache)):
+                if docs:
+                    db[name].insert_many(docs)
+                    counts[name] += len(docs)
+            traffic, cache = [], []
+    return counts
+
+
+def open_database(mongo_uri=None):
+    if mongo_uri is None:
+        import mongomock
+        return mongomock.MongoClient()[BENCH_DATABASE]
+    from pymongo import MongoClient
+    client = MongoClient(mongo_uri)
+    client.drop_database(BENCH_DATABASE)
+    return client[BENCH_DATABASE]
+
+
+def reset_caches():
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+
+def _size(result):
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, dict):
+        return sum(len(v) for v in result.values())
+    return len(result)
+
+
+def _cases(end):
+    city = CELLS.cache_cities[0]
+    region = CELLS.cache_regions[0]
+    return [
+        ('traffic_range', lambda start: traffic_range(start, end)),
+        ('get_traffic_data_date', lambda start: get_traffic_data_date(
+            datetime.datetime.combine(start, datetime.time()), datetime.datetime.combine(end, datetime.time()))),
+        ('city_load', lambda start: city_load(city, start, end)),
+        ('mean_region_cache_load', lambda start: mean_region_cache_load(start, end, region)),
+        ('mean_regions_cache_load', lambda start: mean_regions_cache_load(start, end)),
+        ('cache_city_query', lambda start: cache_city_query(start, end)),
+    ]
+
+
+def measure(fn, repeat=3):
+    """Cold and warm wall time (best of ``repeat``), cold peak traced memory and result size."""
+    cold, warm = [], []
+    for _ in range(repeat):
+        reset_caches()
+        started = time.perf_counter()
+        fn()
+        cold.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        result = fn()
+        warm.append(time.perf_counter() - started)
+    reset_caches()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'cold_seconds': round(min(cold), 6),
+        'warm_seconds': round(min(warm), 6),
+        'peak_bytes': peak,
+        'rows': _size(result),
+    }
+
+
+def run_scale(months, hosts_per_city, top_n, queries, seed, repeat, mongo_uri=None, rollups=False):
+    db = open_database(mongo_uri)
+    use_database(db)
+    started = time.perf_counter()
+    documents = generate(db, months, hosts_per_city, top_n, queries, seed)
+    report = {
+        'months': months,
+        'documents': documents,
+        'generate_seconds': round(time.perf_counter() - started, 3),
+    }
+    if rollups:
+        started = time.perf_counter()
+        update_rollups(db)
+        report['rollup_seconds'] = round(time.perf_counter() - started, 3)
+
+    end = (END - SAMPLE_INTERVAL).date()
+    first = (END - months * 30 * datetime.timedelta(days=1)).date()
+    windows = {'recent': (END - RECENT).date(), 'full': first}
+    report['results'] = {}
+    for name, fn in _cases(end):
+        report['results'][name] = {}
+        for window, start in windows.items():
+            report['results'][name][window] = measure(lambda: fn(start), repeat)
+    use_database(None)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--months', type=float, nargs='+', default=[0.25, 1.0])
+    parser.add_argument('--hosts-per-city', type=int, default=2)
+    parser.add_argument('--top-n', type=int, default=TOP_N)
+    parser.add_argument('--queries', type=int, default=4, help='origin cells queried per sample')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--mongo-uri', help='local mongod to use instead of mongomock')
+    parser.add_argument('--rollups', action='store_true', help='build hourly/daily rollups before timing')
+    parser.add_argument('--output', default='bench.json')
+    args = parser.parse_args(argv)
+
+    # Cached functions warn about the missing Streamlit runtime on every call.
+    streamlit.logger.set_log_level('error')
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'backend': 'mongod' if args.mongo_uri else 'mongomock',
+        },
+        'scales': [],
+    }
+    for months in args.months:
+        scale = run_scale(months, args.hosts_per_city, args.top_n, args.queries, args.seed, args.repeat,
+                          args.mongo_uri, args.rollups)
+        report['scales'].append(scale)
+        for name, windows in scale['results'].items():
+            for window, stats in windows.items():
+                print(f"{months:>6} months {name:>24} {window:>6}: cold {stats['cold_seconds']:.3f}s, "
+                      f"warm {stats['warm_seconds']:.3f}s, peak {stats['peak_bytes'] / 2**20:.1f} MiB, "
+                      f"{stats['rows']} rows")
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Setup shared by every page, done once per process.
+
+Streamlit runs a page script from the top on every widget change.
+``page(title)`` is the header all pages share: page config, diagnostics
+sidebar and the traffic bounds the date inputs need. The first call in
+a process also runs ``bootstrap``, which opens the Mongo client, loads
+the cell registry and opens the shared store. A new replica therefore
+pays for these before its first page draws, and only once.
+
+Plotly is imported when a figure is first built or drawn (see
+``steamgraphs.figures``), not when a page is imported. Cold start and
+rerun times per page are measured by ``python -m steamgraphs.startup``.
+"""
+import streamlit as st
+
+from steamgraphs.cells import CELLS
+from steamgraphs.db import get_db
+from steamgraphs.instrument import diagnostics_sidebar
+from steamgraphs.shared_cache import shared_backend
+from steamgraphs.traffic import traffic_bounds
+
+PAGE_ICON = ':video_game:'
+
+
+@st.cache_resource(show_spinner=False)
+def bootstrap():
+    """Mongo database, cell registry and shared store (or ``None``) of this process."""
+    return get_db(), CELLS, shared_backend()
+
+
+def page(title):
+    """Set up a page; returns ``traffic_bounds()``, ``None`` before any traffic was collected."""
+    st.set_page_config(page_title=title, page_icon=PAGE_ICON, layout='wide')
+    bootstrap()
+    diagnostics_sidebar()
+    return traffic_bounds()
@@ -0,0 +1,275 @@
+import datetime
+import pandas as pd
+import streamlit as st
+
+from steamgraphs import mirror
+from steamgraphs.availability import DOWN_LOAD, down_intervals, host_intervals, mean_load
+from steamgraphs.db import get_db, run_concurrently
+from steamgraphs.instrument import record_miss, timed
+from steamgraphs.live import MAX_TAILS, TAIL_TTL, Tail
+from steamgraphs.loader import load_frame
+from steamgraphs.range_cache import DAY, DayCache
+from steamgraphs.rollups import (CACHE_LOAD, CACHE_SKETCH, FREQ, HOURLY_MAX_SPAN, SKETCH_COLUMNS, as_datetime,
+                                 bucket_expression, resolution_for, rollup_collection, rollup_mean_pipeline,
+                                 rollup_through, split_match)
+from steamgraphs.shared_cache import shared_backend
+from steamgraphs.sketches import sketch_docs, summarize
+
+
+def mean_load_pipeline(match, key, split=None, resolution='raw'):
+    """Aggregation returning the mean ``load`` per ``timestamp`` and ``key``.
+
+    Documents come back flat as ``{'timestamp', key, 'load'}`` sorted by
+    timestamp, so only one row per chart point crosses the wire. ``split``
+    adds a second grouping field, used to fetch several cities or regions
+    with one ``$in`` query. Above ``'raw'`` the samples are averaged into
+    the rollup's buckets.
+    """
+    fields = [key] if split is None else [key, split]
+    timestamp = '$timestamp' if resolution == 'raw' else bucket_expression(resolution)
+    return [
+        {'$match': match},
+        {'$group': {'_id': {'timestamp': timestamp, **{f: f'${f}' for f in fields}}, 'load': {'$avg': '$load'}}},
+        {'$project': {'_id': 0, 'timestamp': '$_id.timestamp', **{f: f'$_id.{f}' for f in fields}, 'load': 1}},
+        {'$sort': {'timestamp': 1, key: 1}},
+    ]
+
+
+def _load_columns(key, split):
+    columns = {'timestamp': 'datetime', key: 'str', 'load': 'float32'}
+    if split is not None:
+        columns[split] = 'str'
+    return columns
+
+
+def rollup_mean_load_rows(match, key, resolution, split=None):
+    """Mean load rows for ``match`` read from the ``resolution`` rollup alone.
+
+    Nothing is read from the raw collection, so rows stop at the rollup's
+    newest bucket and the frame is empty while it has not been built.
+    """
+    rollup = get_db()[rollup_collection(CACHE_LOAD, resolution)]
+    return load_frame(rollup.aggregate(rollup_mean_pipeline(match, key, split)), _load_columns(key, split))
+
+
+def mean_load_rows(match, key, resolution='raw', split=None):
+    """Frame of mean load rows for ``match``, read from a rollup when ``resolution`` allows.
+
+    The rollup answers the range up to its newest bucket; the rest, or all
+    of it while the rollup has not been built, is aggregated from the raw
+    collection into the same buckets.
+    """
+    db = get_db()
+    columns = _load_columns(key, split)
+    if resolution == 'raw':
+        return load_frame(db.cache.aggregate(mean_load_pipeline(match, key, split)), columns)
+    rolled, rest = split_match(match, rollup_through(db[rollup_collection(CACHE_LOAD, resolution)]))
+    frames = []
+    if rolled is not None:
+        frames.append(rollup_mean_load_rows(rolled, key, resolution, split))
+    if rest is not None:
+        frames.append(load_frame(db.cache.aggregate(mean_load_pipeline(rest, key, split, resolution)), columns))
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def mirror_mean_load_rows(days, filters, key, resolution='raw', split=None):
+    """``mean_load_rows`` for whole mirrored ``days``, computed locally."""
+    fields = [key] if split is None else [key, split]
+    df = mirror.read('cache', days, ['timestamp', 'load', *fields], where=filters)
+    if df.empty:
+        return pd.DataFrame(columns=['timestamp', *fields, 'load'])
+    timestamp = df['timestamp'] if resolution == 'raw' else df['timestamp'].dt.floor(FREQ[resolution])
+    groups = [timestamp.rename('timestamp')] + [df[f].astype(object) for f in fields]
+    rows = df['load'].astype('float64').groupby(groups).mean().astype('float32').reset_index()
+    return rows[['timestamp', key, 'load'] + fields[1:]]
+
+
+def mean_load_range(filters, key, resolution, start, stop, split=None):
+    """``mean_load_rows`` over ``[start, stop)``; days in the mirror are read locally."""
+    days, ranges = mirror.coverage('cache', start, stop)
+    frames = [mirror_mean_load_rows(days, filters, key, resolution, split)] if days else []
+    for range_start, range_stop in ranges:
+        match = {'timestamp': {'$gte': range_start, '$lt': range_stop}, **filters}
+        frames.append(mean_load_rows(match, key, resolution, split))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=['timestamp', key, 'load'] + ([] if split is None else [split]))
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def _split_days(df):
+    return {day.date(): part for day, part in df.groupby(df['timestamp'].dt.normalize())}
+
+
+def _fetch_mean_load_days(key, start, stop):
+    group, resolution, filters = key
+    df = mean_load_range(dict(filters), group, resolution, start, stop)
+    if df.empty:
+        return {}
+    return _split_days(df)
+
+
+@st.cache_resource
+def mean_load_days():
+    return DayCache(_fetch_mean_load_days, shared=shared_backend(), name='mean_load')
+
+
+def _day_cache_key(filters, group, resolution):
+    return (group, resolution, tuple(sorted(filters.items())))
+
+
+def prefetch_mean_load(filters, split, values, group, resolution, start, end):
+    """Fill the day cache for ``filters`` plus each ``split`` value with one ``$in`` query.
+
+    Only values with missing days are fetched, over the union of their
+    missing days; the result is split locally per value and per day.
+    """
+    cache = mean_load_days()
+    keys = {v: _day_cache_key({**filters, split: v}, group, resolution) for v in values}
+    runs = {v: cache.missing_runs(keys[v], start.date(), end.date()) for v in values}
+    pending = [v for v in values if runs[v]]
+    if not pending:
+        return
+    first = min(runs[v][0][0] for v in pending)
+    last = max(runs[v][-1][1] for v in pending)
+    df = mean_load_range({**filters, split: {'$in': pending}}, group, resolution,
+                         datetime.datetime.combine(first, datetime.time()),
+                         datetime.datetime.combine(last + DAY, datetime.time()), split)
+    for v in pending:
+        part = df[df[split] == v].drop(columns=split) if not df.empty else df
+        cache.store(keys[v], first, last, _split_days(part.reset_index(drop=True)) if not part.empty else {})
+
+
+def cached_mean_load_rows(filters, group, resolution, start, end):
+    """Mean load rows with ``start <= timestamp <= end``, assembled from day partials."""
+    key = _day_cache_key(filters, group, resolution)
+    parts = [p for p in mean_load_days().get(key, start.date(), end.date()) if p is not None]
+    if not parts:
+        return pd.DataFrame(columns=['timestamp', group, 'load'])
+    df = pd.concat(parts, ignore_index=True)
+    return df[(df['timestamp'] >= start) & (df['timestamp'] <= end)]
+
+
+def mean_load_frame(df, key):
+    if df.empty:
+        return pd.DataFrame()
+    return df.pivot(index='timestamp', columns=key, values='load')
+
+
+@timed()
+def city_load(city, start, end, resolution=None):
+    resolution = resolution or resolution_for(start, end)
+    s = datetime.datetime.combine(start, datetime.time())
+    e = datetime.datetime.combine(end, datetime.time())
+    df = cached_mean_load_rows({'city': city, 'type': 'SteamCache'}, 'host', resolution, s, e)
+    return _city_frame(df)
+
+
+def _city_frame(df):
+    """Load rows, sample times, hosts and the intervals each host was down."""
+    if df.empty:
+        return pd.DataFrame(columns=['timestamp', 'host', 'load']), [], [], down_intervals(host_intervals([], []))
+    rows = df[['timestamp', 'host', 'load']].reset_index(drop=True)
+    dates = df.timestamp.unique()
+    hosts = list(df.host.unique())
+    down = down_intervals(host_intervals(rows['timestamp'], rows['host'], pd.DatetimeIndex(dates).sort_values()))
+    return rows, dates, hosts, down
+
+
+@st.cache_resource(max_entries=MAX_TAILS, ttl=TAIL_TTL, show_spinner=False)
+def city_tail(city, since, resolution):
+    """Mean load rows of ``city``'s caches from ``since`` onwards at ``resolution``."""
+    def fetch(start):
+        return mean_load_rows({'city': city, 'type': 'SteamCache', 'timestamp': {'$gte': start}}, 'host', resolution)
+
+    return Tail(fetch, since)
+
+
+@timed()
+def live_city_load(city, start, resolution):
+    """``city_load`` from ``start`` up to the newest sample, kept current by polling."""
+    return _city_frame(city_tail(city, as_datetime(start), resolution).rows())
+
+
+@timed()
+def mean_region_cache_load(start, end, region, down_load=DOWN_LOAD, resolution=None):
+    """Mean load of the region's caches; caches not reporting count as ``down_load``, or are left out if ``None``."""
+    region = region.replace(' ', '_')
+    resolution = resolution or resolution_for(start, end)
+    start = datetime.datetime.combine(start, datetime.time())
+    end = datetime.datetime.combine(end, datetime.time()) + datetime.timedelta(days=1)
+    df = cached_mean_load_rows({'region': region, 'type': 'SteamCache'}, 'host', resolution, start, end)
+    return mean_load(df, 'host', down_load)
+
+
+@timed()
+def mean_regions_cache_load(start, end):
+    resolution = resolution_for(start, end)
+    start = datetime.datetime.combine(start, datetime.time())
+    end = datetime.datetime.combine(end, datetime.time()) + datetime.timedelta(days=1)
+    df = cached_mean_load_rows({}, 'region', resolution, start, end)
+    return mean_load_frame(df, 'region').fillna(100)
+
+
+@timed()
+def city_loads(requests):
+    """``city_load`` for several ``(city, start, end)`` requests.
+
+    Requests over the same dates share one ``$in`` query; distinct date
+    ranges are fetched concurrently.
+    """
+    by_range = {}
+    for city, start, end in requests:
+        by_range.setdefault((start, end), []).append(city)
+
+    def prefetch(start, end, cities):
+        s = datetime.datetime.combine(start, datetime.time())
+        e = datetime.datetime.combine(end, datetime.time())
+        prefetch_mean_load({'type': 'SteamCache'}, 'city', cities, 'host', resolution_for(start, end), s, e)
+
+    run_concurrently(prefetch, [(start, end, cities) for (start, end), cities in by_range.items()])
+    return [city_load(city, start, end) for city, start, end in requests]
+
+
+@timed()
+def mean_region_cache_loads(start, end, regions, down_load=DOWN_LOAD):
+    """``mean_region_cache_load`` for several regions, fetched with one ``$in`` query."""
+    names = [r.replace(' ', '_') for r in regions]
+    s = datetime.datetime.combine(start, datetime.time())
+    e = datetime.datetime.combine(end, datetime.time()) + datetime.timedelta(days=1)
+    prefetch_mean_load({'type': 'SteamCache'}, 'region', names, 'host', resolution_for(start, end), s, e)
+    return {r: mean_region_cache_load(start, end, r, down_load) for r in regions}
+
+
+def load_sketches(filters, resolution, start, end):
+    """Load sketches for ``filters`` in ``[start, end)``; what the rollup does not cover yet is built from raw samples."""
+    db = get_db()
+    rollup = db[rollup_collection(CACHE_SKETCH, resolution)]
+    rolled, rest = split_match({'timestamp': {'$gte': start, '$lt': end}, **filters}, rollup_through(rollup))
+    docs = [] if rolled is None else list(rollup.find(rolled, {'_id': 0}))
+    if rest is not None:
+        cursor = db.cache.find(rest, {'_id': 0, **{c: 1 for c in SKETCH_COLUMNS}})
+        docs += sketch_docs(load_frame(cursor, SKETCH_COLUMNS), resolution)
+    return docs
+
+
+@timed()
+@st.cache_data(ttl=600)
+@record_miss
+def load_distribution(start, end, region=None, city=None):
+    """Load percentiles, maximum and overloaded hosts of a region's or a city's caches.
+
+    Returns ``(buckets, total)``: a frame with a row per hour, or per day
+    over long ranges, and a Series for the whole range, both merged from
+    stored sketches.
+    """
+    filters = {'type': 'SteamCache'}
+    if region:
+        filters['region'] = region.replace(' ', '_')
+    if city:
+        filters['city'] = city
+    start = as_datetime(start)
+    end = as_datetime(end) + datetime.timedelta(days=1)
+    resolution = 'hourly' if end - start <= HOURLY_MAX_SPAN else 'daily'
+    docs = load_sketches(filters, resolution, start, end)
+    return summarize(docs, 'timestamp'), summarize(docs)
@@ -0,0 +1,76 @@
+"""Registry of the Steam cells in ``CellMap.json``, loaded once per process.
+
+Every cell is a slotted ``Cell`` record, indexed by cell id, city, region
+and cache code. The registry also keeps the city code tables the loaders
+and the heatmap share: ``cities`` is the sorted list of city names,
+``city_code`` maps a name to its position in it, ``origin_code`` maps a
+cell id straight to that code and ``city_dtype`` is the matching
+categorical dtype for ``load_frame``.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+CELLMAP_PATH = 'CellMap.json'
+
+
+class Cell:
+    __slots__ = ('cell_id', 'region', 'code', 'cm', 'cache', 'city')
+
+    def __init__(self, cell_id, region, code, cm, cache, city):
+        self.cell_id = cell_id
+        self.region = region
+        self.code = code
+        self.cm = cm
+        self.cache = cache
+        self.city = city
+
+    def __repr__(self):
+        return f'Cell({self.cell_id}, {self.city!r}, {self.region!r}, cache={self.cache!r})'
+
+
+class CellRegistry:
+
+    def __init__(self, cells):
+        self.cells = tuple(cells)
+        self.by_id = {c.cell_id: c for c in self.cells}
+        self.by_cache = {c.cache: c for c in self.cells if c.cache}
+        self.by_city = {}
+        self.by_region = {}
+        for c in self.cells:
+            self.by_city.setdefault(c.city, []).append(c)
+            self.by_region.setdefault(c.region, []).append(c)
+        self.by_city = {k: tuple(v) for k, v in self.by_city.items()}
+        self.by_region = {k: tuple(v) for k, v in self.by_region.items()}
+
+        self.cities = np.array(sorted(self.by_city), dtype=object)
+        self.city_code = {c: i for i, c in enumerate(self.cities)}
+        self.city_dtype = pd.CategoricalDtype(self.cities)
+        self.origin_code = np.full(max(self.by_id, default=-1) + 1, -1, dtype=np.int64)
+        for c in self.cells:
+            self.origin_code[c.cell_id] = self.city_code[c.city]
+
+        self.region_cache_cities = {
+            region: tuple(dict.fromkeys(c.city for c in cells if c.cache))
+            for region, cells in self.by_region.items()
+        }
+        self.region_cache_codes = {
+            region: np.array(sorted(self.city_code[c] for c in cities), dtype=np.int64)
+            for region, cities in self.region_cache_cities.items()
+        }
+        self.cache_regions = tuple(r for r, cities in self.region_cache_cities.items() if cities)
+        self.cache_cities = tuple(sorted({c.city for c in self.by_cache.values()}))
+
+    @classmethod
+    def from_json(cls, path=CELLMAP_PATH):
+        with open(path, 'r', encoding='utf-8') as file:
+            cell_map = json.load(file)
+        return cls(Cell(int(k), v['region'], v['code'], v['cm'], v['cache'], v['city']) for k, v in cell_map.items())
+
+    def region_of(self, city):
+        """Region of ``city``; a city listed under several regions keeps its first one."""
+        return self.by_city[city][0].region
+
+
+CELLS = CellRegistry.from_json()
@@ -0,0 +1,104 @@
+"""Correlation between regional traffic and cache load, for every region at once.
+
+``align`` matches each region's mean cache load samples with the latest
+traffic sample at or before them, an as-of merge on the sorted timestamps
+within a tolerance, and returns two frames sharing the same timestamps
+and region columns. The rolling correlation and the lag estimates then
+run on those whole frames, all regions in the same operations, instead of
+aligning series chart by chart with ``isin``.
+
+Lags are whole samples of the aligned frames, reported as durations; a
+positive lag means cache load follows traffic.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from steamgraphs.cache_load import cached_mean_load_rows, mean_load_frame
+from steamgraphs.instrument import record_miss, timed
+from steamgraphs.rollups import as_datetime, resolution_for
+from steamgraphs.traffic import traffic_range
+
+# Rolling windows and as-of tolerances per data resolution.
+WINDOWS = {'raw': '6h', 'hourly': '3D', 'daily': '28D'}
+TOLERANCES = {'raw': pd.Timedelta(minutes=15), 'hourly': pd.Timedelta(hours=1), 'daily': pd.Timedelta(days=1)}
+MIN_SAMPLES = 6
+MAX_LAG = 12
+LAG_COLUMNS = ['lag', 'correlation', 'samples']
+
+
+def align(traffic, load, tolerance=None):
+    """``(traffic, load)`` on the load's timestamps, for the regions present in both."""
+    regions = [r for r in load.columns if r in traffic.columns]
+    left = load[regions].sort_index()
+    right = traffic[regions].sort_index().add_suffix(' traffic')
+    left.index = left.index.astype('datetime64[ns]')
+    right.index = right.index.astype('datetime64[ns]')
+    joined = pd.merge_asof(left, right, left_index=True, right_index=True,
+                           direction='backward', tolerance=tolerance)
+    return joined[right.columns].set_axis(regions, axis=1), left
+
+
+def rolling_correlation(traffic, load, window, min_periods=MIN_SAMPLES):
+    """Pearson correlation of every region's columns over a trailing ``window``."""
+    return load.rolling(window, min_periods=min_periods).corr(traffic)
+
+
+def lag_profile(traffic, load, max_lag=MAX_LAG, step=None):
+    """Correlation of load with traffic shifted by ``-max_lag`` to ``max_lag`` steps.
+
+    Both frames are first put on a regular grid of ``step``, by default
+    the median sample spacing, with missing samples as NaN, so a shift is
+    always ``step`` in time, also across outages. Rows are indexed by the
+    lag as a duration.
+    """
+    if step is None:
+        step = load.index.to_series().diff().median()
+    if pd.notna(step):
+        grid = pd.date_range(load.index[0], load.index[-1], freq=step)
+        load = load.reindex(grid, method='nearest', tolerance=step / 2)
+        traffic = traffic.reindex(grid, method='nearest', tolerance=step / 2)
+    lags = range(-max_lag, max_lag + 1)
+    return pd.DataFrame([load.corrwith(traffic.shift(k)) for k in lags],
+                        index=pd.Index([k * step for k in lags], name='lag'))
+
+
+def estimate_lags(profile):
+    """Lag with the strongest correlation per region, as a frame indexed by region.
+
+    A region without any correlation in the profile gets a missing lag.
+    """
+    values = profile.to_numpy()
+    strength = np.abs(values)
+    best = np.where(np.isnan(strength), -1, strength).argmax(axis=0)
+    return pd.DataFrame({
+        'lag': profile.index[best].where(~np.isnan(strength).all(axis=0)),
+        'correlation': values[best, np.arange(values.shape[1])],
+    }, index=pd.Index(profile.columns, name='region'))
+
+
+@timed()
+@st.cache_data(ttl=600)
+@record_miss
+def region_correlation(start, end, max_lag=MAX_LAG):
+    """Rolling correlation, lag profile and lag estimates of all regions between ``start`` and ``end``.
+
+    Returns ``(rolling, profile, lags)``; all are empty when there is
+    nothing to compare.
+    """
+    resolution = resolution_for(start, end)
+    s = as_datetime(start)
+    e = as_datetime(end) + datetime.timedelta(days=1)
+    load = mean_load_frame(cached_mean_load_rows({'type': 'SteamCache'}, 'region', resolution, s, e), 'region')
+    traffic = traffic_range(s, e, resolution)
+    if not load.empty and not traffic.empty:
+        traffic, load = align(traffic, load, TOLERANCES[resolution])
+    if load.empty or traffic.empty:
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(columns=LAG_COLUMNS)
+    rolling = rolling_correlation(traffic, load, WINDOWS[resolution])
+    profile = lag_profile(traffic, load, max_lag)
+    lags = estimate_lags(profile)
+    lags['samples'] = (load.notna() & traffic.notna()).sum()
+    return rolling, profile, lags
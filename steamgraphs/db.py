@@ -0,0 +1,56 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from pymongo import MongoClient
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from steamgraphs.instrument import event_listeners
+
+MAX_WORKERS = 4
+
+_database = None
+
+
+@st.cache_resource
+def init_connection():
+
+    return MongoClient(**st.secrets["mongo"], event_listeners=event_listeners())
+
+
+def get_db():
+    if _database is not None:
+        return _database
+    return init_connection().steam
+
+
+def use_database(db):
+    """Route every shared query to ``db`` instead of the configured server.
+
+    Used by scripts and benchmarks that run outside Streamlit, e.g. with a
+    mongomock database or a local mongod.
+    """
+    global _database
+    _database = db
+
+
+def run_concurrently(fn, calls):
+    """``[fn(*args) for args in calls]`` on a bounded thread pool.
+
+    Workers share the pooled MongoClient and inherit the calling script's
+    context, and the caller's context variables, so Streamlit caches and
+    diagnostics behave as in the script thread.
+    """
+    if len(calls) <= 1:
+        return [fn(*args) for args in calls]
+    ctx = get_script_run_ctx()
+    context = contextvars.copy_context()
+
+    def call(args):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return context.copy().run(fn, *args)
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(calls))) as pool:
+        return list(pool.map(call, calls))
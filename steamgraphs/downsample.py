@@ -0,0 +1,64 @@
+"""Min/max downsampling of time series before they are handed to Plotly.
+
+Each series is cut into ``width`` equal time buckets, one per horizontal
+pixel of a wide chart, and only the smallest and largest sample of every
+bucket is kept. Peaks therefore survive unchanged. A bucket that contains
+a missing value also keeps one of those, so line charts still break at
+gaps.
+"""
+import numpy as np
+import pandas as pd
+
+CHART_WIDTH = 1600
+
+
+def minmax_indices(x, y, n_buckets):
+    """Sorted positions of the min and max sample of ``y`` per time bucket of ``x``.
+
+    Min and max are taken over the finite samples; a bucket with missing
+    values adds the position of its first one.
+    """
+    x = np.asarray(x).astype('int64')
+    y = np.asarray(y, dtype='float64')
+    span = x[-1] - x[0]
+    if span <= 0:
+        return np.arange(len(x))
+    buckets = ((x - x[0]) * (n_buckets / span)).astype('int64')
+    np.minimum(buckets, n_buckets - 1, out=buckets)
+    missing = np.isnan(y)
+    finite = np.flatnonzero(~missing)
+    # Sort the finite samples by bucket, then value.
+    order = finite[np.lexsort((y[finite], buckets[finite]))]
+    first = _bucket_starts(buckets[order])
+    last = np.r_[first[1:], len(order)] - 1 if len(first) else first
+    gaps = np.flatnonzero(missing)
+    gaps = gaps[_bucket_starts(buckets[gaps])]
+    return np.union1d(np.union1d(order[first], order[last]), gaps)
+
+
+def _bucket_starts(sorted_buckets):
+    if len(sorted_buckets) == 0:
+        return np.empty(0, dtype='int64')
+    return np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+
+
+def downsample(series, width=CHART_WIDTH):
+    """Reduce a time-indexed Series to at most ``3 * width`` points, ``2 * width`` without gaps."""
+    if len(series) <= 2 * width:
+        return series
+    return series.iloc[minmax_indices(series.index.values, series.values, width)]
+
+
+def downsample_columns(df, width=CHART_WIDTH):
+    """Downsample every column on its own and return them in long form.
+
+    The result has the frame's index plus ``variable`` and ``value`` columns,
+    the layout ``plotly.express`` uses for wide frames, so each column keeps
+    its own extremes without padding the others with extra rows.
+    """
+    series = {c: downsample(df[c], width) for c in df.columns}
+    index_name = df.index.name or 'index'
+    if not series:
+        return pd.DataFrame(columns=[index_name, 'variable', 'value'])
+    long = pd.concat(series, names=['variable', index_name]).rename('value')
+    return long.reset_index()[[index_name, 'variable', 'value']]
@@ -0,0 +1,400 @@
+"""Page figures, cached by query descriptor, and a warm-up job for the default views.
+
+The charts are built from what a view asks for, its descriptor (the
+dates, region or city and toggles), instead of from the frames handed to
+a cached graph function, which Streamlit would hash on every rerun.
+``figure_spec(view, *descriptor)`` returns the figure as a Plotly JSON
+spec, cached in-process by the descriptor alone and, when
+``STEAMGRAPHS_SHARED_CACHE`` names a store, across processes.
+
+Plotly is imported by the builders, when a figure is first built, so
+pages import this module without it. ``show_figure`` draws a spec from
+a figure built once per process, which saves parsing and validating the
+spec again on every rerun.
+
+Every visitor lands on the same default views, so the warm-up job builds
+those and puts them in the shared store after each data refresh, making
+the first paint a cache lookup::
+
+    python -m steamgraphs.rollups && python -m steamgraphs.figures
+"""
+import argparse
+import datetime
+import json
+import sys
+
+import streamlit as st
+import streamlit.logger
+
+from steamgraphs.availability import DOWN_LOAD
+from steamgraphs.cache_load import city_load, city_loads, load_distribution, mean_region_cache_load, mean_region_cache_loads
+from steamgraphs.cells import CELLS
+from steamgraphs.correlation import region_correlation
+from steamgraphs.downsample import downsample, downsample_columns
+from steamgraphs.heatmap import cache_city_query
+from steamgraphs.instrument import plotly_chart, record_miss, timed
+from steamgraphs.rollups import resolution_for
+from steamgraphs.shared_cache import ENV, shared_backend
+from steamgraphs.traffic import traffic_bounds, traffic_range
+
+FIGURE_TTL = 900
+DEFAULT_SPAN = datetime.timedelta(hours=48)
+HEATMAP_SPAN = datetime.timedelta(days=7)
+
+
+def traffic_figure(df, region=None, inc_global=False, full_resolution=False):
+    import plotly.express as px
+
+    if region:
+        cols = [c.replace(' ', '_') for c in region]
+    elif inc_global:
+        cols = list(df.columns)
+    else:
+        cols = [c for c in df.columns if c != 'Global']
+    if full_resolution:
+        fig = px.line(df, x=df.index, y=cols)
+    else:
+        plot_df = downsample_columns(df[cols])
+        fig = px.line(plot_df, x=plot_df.columns[0], y='value', color='variable')
+
+    fig.update_layout(
+        xaxis_title="Date",
+        yaxis_title="Traffic (Gbps)",
+        xaxis_tickformat='%y-%m-%d %H',
+        legend_title_text='Regions',
+        height=600,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1,
+            entrywidth=120,
+        ),
+    )
+    return fig
+
+
+def city_load_figure(rows, dates, hosts, down, overlay_region=False, region=None, traffic_df=None, full_resolution=False):
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    loads = {host: part.set_index('timestamp')['load'] for host, part in rows.groupby('host', sort=False)}
+    down_by_host = dict(iter(down.groupby('host', sort=False)))
+    for i, host in enumerate(hosts):
+        color = qualitative.Plotly[i % len(qualitative.Plotly)]
+        host_load = loads[host] if full_resolution else downsample(loads[host])
+        fig.add_trace(go.Scatter(x=host_load.index, y=host_load, mode='markers', name=host.split('.')[0],
+                                 legendgroup=host, marker_color=color))
+        if host in down_by_host:
+            # One segment per interval the host was not seen, above the load range.
+            gaps = down_by_host[host]
+            x = [t for start, end in zip(gaps['start'], gaps['end']) for t in (start, end, None)]
+            fig.add_trace(go.Scatter(x=x, y=[105 + i * 2] * len(x), mode='lines+markers', name=f"{host.split('.')[0]} down",
+                                     legendgroup=host, showlegend=False, line_color=color, marker_color=color))
+    fig.update_layout(
+        xaxis_title='Date',
+        yaxis_title='Cache Server load',
+        xaxis_tickformat='%y-%m-%d %H',
+        yaxis_range=[0, len(hosts) * 2 + 130],
+        xaxis_range=[dates[0], dates[-1] + datetime.timedelta(minutes=10)],
+        showlegend=True,
+        legend_title_text='Hosts',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1,
+            entrywidth=100,
+        ),
+        height=600,
+    )
+    fig.add_hline(y=100, line_dash="dash", line_color="red", name='Max Load')
+    if overlay_region:
+        region_traffic = traffic_df[region]
+        region_traffic_filtered = region_traffic[region_traffic.index.isin(dates)]
+        if not full_resolution:
+            region_traffic_filtered = downsample(region_traffic_filtered)
+        fig.add_trace(trace=go.Scatter(x=region_traffic_filtered.index,
+                                       y=region_traffic_filtered,
+                                       mode='lines',
+                                       name=f'Traffic for {region}'),
+                      secondary_y=True,
+                      )
+    return fig
+
+
+def mean_load_figure(mean_load, overlay_traffic=False, traffic_df=None, region=None, full_resolution=False):
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    mean_load = mean_load.sort_index()
+    dates = mean_load.index
+
+    if overlay_traffic:
+        region_traffic = traffic_df[region.replace(' ', '_')]
+        region_traffic_filtered = region_traffic[region_traffic.index.isin(dates)].sort_index()
+        if not full_resolution:
+            mean_load = downsample(mean_load)
+            region_traffic_filtered = downsample(region_traffic_filtered)
+        fig.add_scatter(x=mean_load.index, y=mean_load, mode='lines', name='Mean Cache load')
+        fig.add_scatter(x=region_traffic_filtered.index, y=region_traffic_filtered, mode='lines', name=f'Mean Traffic for {region}', secondary_y=True)
+    else:
+        mean_load = mean_load if full_resolution else downsample(mean_load)
+        fig.add_scatter(x=mean_load.index, y=mean_load, mode='lines', name='Mean Cache Load')
+
+    fig.update_layout(
+        title=f'Mean Cache Load for {region}',
+        xaxis_title='Date',
+        yaxis_title='Cache Server load',
+        xaxis_tickformat='%y-%m-%d %H',
+        yaxis_range=[0, 120],
+        xaxis_range=[dates[0], dates[-1] + datetime.timedelta(minutes=10)],
+        showlegend=True,
+        legend_title_text='Hosts',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1,
+        ),
+        height=600,
+    )
+    return fig
+
+
+def heatmap_figure(df):
+    import plotly.express as px
+
+    mask = df.columns.values != df.index.to_numpy()[:, None]
+    max_value = df.where(mask).max().max() * 1.2
+    fig = px.imshow(df, labels=dict(x="Query Origin",
+                                    y="Cache City",
+                                    color="Cache count"),
+                    text_auto=True,
+                    height=600,
+                    aspect='auto',
+                    color_continuous_scale='Hot_r',
+                    zmax=max_value)
+    fig.update_coloraxes(showscale=False)
+    return fig
+
+
+def load_distribution_figure(buckets, region=None):
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    for name, label in (('p50', 'Median'), ('p95', '95th percentile'), ('max', 'Maximum')):
+        fig.add_scatter(x=buckets.index, y=buckets[name], mode='lines', name=label)
+    fig.add_bar(x=buckets.index, y=buckets['hosts_over'], name='Caches above 100', opacity=0.3, secondary_y=True)
+    fig.update_layout(
+        title=f'Cache Load distribution for {region}',
+        xaxis_title='Date',
+        yaxis_title='Cache Server load',
+        xaxis_tickformat='%y-%m-%d %H',
+        yaxis_range=[0, 130],
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1,
+        ),
+        height=500,
+    )
+    fig.update_yaxes(title_text='Caches above 100', secondary_y=True)
+    fig.add_hline(y=100, line_dash="dash", line_color="red")
+    return fig
+
+
+def rolling_correlation_figure(rolling):
+    import plotly.express as px
+
+    fig = px.imshow(rolling.T.rename(index=lambda r: r.replace('_', ' ')),
+                    labels=dict(x="Date", y="Region", color="Correlation"),
+                    height=500,
+                    aspect='auto',
+                    color_continuous_scale='RdBu',
+                    zmin=-1,
+                    zmax=1)
+    fig.update_layout(xaxis_tickformat='%y-%m-%d %H')
+    return fig
+
+
+def lag_profile_figure(profile):
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+    minutes = profile.index / datetime.timedelta(minutes=1)
+    for region in profile.columns:
+        fig.add_scatter(x=minutes, y=profile[region], mode='lines+markers', name=region.replace('_', ' '))
+    fig.update_layout(
+        xaxis_title='Lag of cache load behind traffic (minutes)',
+        yaxis_title='Correlation',
+        yaxis_range=[-1, 1],
+        legend_title_text='Regions',
+        height=500,
+    )
+    fig.add_vline(x=0, line_dash="dash", line_color="grey")
+    return fig
+
+
+def _traffic_view(start, end, region, inc_global, full_resolution):
+    df = traffic_range(start, end)
+    if df.empty:
+        return None
+    return traffic_figure(df, list(region), inc_global, full_resolution)
+
+
+def _city_load_view(city, start, end, overlay_region, full_resolution):
+    rows, dates, hosts, down = city_load(city, start, end)
+    if rows.empty:
+        return None
+    region = CELLS.region_of(city)
+    traffic_df = traffic_range(start, end) if overlay_region else None
+    return city_load_figure(rows, dates, hosts, down, overlay_region, region, traffic_df, full_resolution)
+
+
+def _mean_load_view(region, start, end, overlay_traffic, full_resolution, down_load):
+    mean_load = mean_region_cache_load(start, end, region, down_load)
+    if mean_load.empty:
+        return None
+    traffic_df = None
+    if overlay_traffic:
+        traffic_df = traffic_range(start, end + datetime.timedelta(days=1), resolution_for(start, end))
+    return mean_load_figure(mean_load, overlay_traffic, traffic_df, region, full_resolution)
+
+
+def _heatmap_view(region, start, end):
+    df = cache_city_query(start, end).get(region.replace(' ', '_'))
+    if df is None:
+        return None
+    return heatmap_figure(df)
+
+
+def _load_distribution_view(region, start, end):
+    buckets, _ = load_distribution(start, end, region=region)
+    if buckets.empty:
+        return None
+    return load_distribution_figure(buckets, region)
+
+
+def _rolling_correlation_view(start, end):
+    rolling, _, _ = region_correlation(start, end)
+    if rolling.empty:
+        return None
+    return rolling_correlation_figure(rolling)
+
+
+def _lag_profile_view(start, end):
+    _, profile, _ = region_correlation(start, end)
+    if profile.empty:
+        return None
+    return lag_profile_figure(profile)
+
+
+VIEWS = {
+    'traffic': _traffic_view,
+    'city_load': _city_load_view,
+    'mean_load': _mean_load_view,
+    'heatmap': _heatmap_view,
+    'load_distribution': _load_distribution_view,
+    'rolling_correlation': _rolling_correlation_view,
+    'lag_profile': _lag_profile_view,
+}
+
+
+def figure_key(view, descriptor):
+    return f'figure:{view}:{descriptor!r}'
+
+
+def build_spec(view, *descriptor):
+    fig = VIEWS[view](*descriptor)
+    return None if fig is None else fig.to_json()
+
+
+@timed('graph')
+@st.cache_data(ttl=600, show_spinner=False)
+@record_miss
+def figure_spec(view, *descriptor):
+    """JSON spec of ``view``'s figure for ``descriptor``, or ``None`` when there is no data.
+
+    The descriptor must be hashable, plain values: dates, strings, bools,
+    tuples. Specs left in the shared store by the warm-up job are used
+    as they are.
+    """
+    shared = shared_backend()
+    if shared is None:
+        return build_spec(view, *descriptor)
+    key = figure_key(view, descriptor)
+    entry = shared.get(key)
+    if entry is None:
+        entry = (build_spec(view, *descriptor),)
+        shared.set(key, entry, FIGURE_TTL)
+    return entry[0]
+
+
+@st.cache_resource(max_entries=64, ttl=600, show_spinner=False)
+def figure_from_spec(spec):
+    """The figure of a spec, parsed and validated once per process; shared, so never modify it."""
+    import plotly.graph_objects as go
+
+    return go.Figure(json.loads(spec))
+
+
+def show_figure(spec, key=None):
+    """Draw a spec from ``figure_spec``; ``key`` tells apart charts that may show the same view."""
+    plotly_chart(figure_from_spec(spec), use_container_width=True, key=key)
+
+
+def default_views(first, last):
+    """Descriptors of the views every page opens with, for every region and city."""
+    start = max(first, last - DEFAULT_SPAN).date()
+    end = last.date()
+    regions = [r.replace('_', ' ') for r in CELLS.cache_regions]
+    views = [('traffic', start, end, (), False, False)]
+    views += [('city_load', city, start, end, False, False) for city in CELLS.cache_cities]
+    views += [('mean_load', region, start, end, False, False, DOWN_LOAD) for region in regions]
+    views += [('heatmap', region, (last - HEATMAP_SPAN).date(), end) for region in regions]
+    return views
+
+
+def warm(shared, views=None):
+    """Build ``views`` (default: ``default_views``) and store their specs; returns how many were stored."""
+    if views is None:
+        bounds = traffic_bounds()
+        if bounds is None:
+            return 0
+        views = default_views(*bounds[:2])
+    # Fetch the per-city and per-region data with batched queries first.
+    city_loads([(city, start, end) for view, city, start, end, *_ in views if view == 'city_load'])
+    by_range = {}
+    for view, region, start, end, *rest in views:
+        if view == 'mean_load':
+            by_range.setdefault((start, end, rest[-1]), []).append(region)
+    for (start, end, down_load), regions in by_range.items():
+        mean_region_cache_loads(start, end, regions, down_load)
+    for view, *descriptor in views:
+        shared.set(figure_key(view, tuple(descriptor)), (build_spec(view, *descriptor),), FIGURE_TTL)
+    return len(views)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args(argv)
+    streamlit.logger.set_log_level('error')
+    shared = shared_backend()
+    if shared is None:
+        print(f'{ENV} is not set; there is no shared store to warm.', file=sys.stderr)
+        return 1
+    print(f'{warm(shared)} figures stored')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
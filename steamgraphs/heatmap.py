@@ -0,0 +1,151 @@
+"""Origin × cache-city counts behind the cache load heatmap.
+
+Every query a client city made is answered by a ranked list of caches; the
+heatmap counts how often each cache city appears in the top ``TOP_N``
+entries per origin. Counting is done on integer codes into one square
+matrix with a slot per cell, ordered by city name, and each region's
+heatmap is an index selection of that matrix. Origins are counted per
+cell, so a city with several cells (Cairo, Malmo) keeps a row and a
+column per cell, labelled with the city name as the original pivot did.
+Counts are cached per day as sparse cell counts, so moving the date range
+only fetches the days not seen before.
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from steamgraphs import mirror
+from steamgraphs.cells import CELLS
+from steamgraphs.db import get_db
+from steamgraphs.instrument import timed
+from steamgraphs.loader import load_frame
+from steamgraphs.range_cache import DAY, DayCache
+from steamgraphs.shared_cache import shared_backend
+
+TOP_N = 5
+
+
+_SLOTS = sorted(CELLS.cells, key=lambda c: (c.city, c.cell_id))
+LABELS = np.array([c.city for c in _SLOTS], dtype=object)
+ORIGIN_CODE = np.full(len(CELLS.origin_code), -1, dtype=np.int64)
+ORIGIN_CODE[[c.cell_id for c in _SLOTS]] = np.arange(len(_SLOTS))
+# A cache city is counted in the slot of its first cell.
+_CITY_SLOT = {c.city: slot for slot, c in reversed(list(enumerate(_SLOTS)))}
+CACHE_CODE = np.array([_CITY_SLOT[c] for c in CELLS.cities], dtype=np.int64)
+REGION_CACHES = {r: np.sort(CACHE_CODE[codes]) for r, codes in CELLS.region_cache_codes.items()}
+
+
+def top_n_mask(group, n=TOP_N):
+    """True for the first ``n`` rows of every group, in row order.
+
+    Vectorized equivalent of ``groupby(...).head(n)`` for integer group ids.
+    """
+    order = np.argsort(group, kind='stable')
+    ordered = group[order]
+    starts = np.r_[True, ordered[1:] != ordered[:-1]]
+    positions = np.arange(len(group))
+    rank = np.empty(len(group), dtype=np.int64)
+    rank[order] = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+    return rank < n
+
+
+def top_entry_cells(timestamps, query_ids, cache_cities):
+    """Timestamp and flat ``cache * len(LABELS) + origin`` cell of every counted entry."""
+    n = len(LABELS)
+    ts_code = pd.factorize(timestamps)[0]
+    query_ids = pd.to_numeric(pd.Series(query_ids), errors='coerce').to_numpy()
+    known = ~np.isnan(query_ids) & (ts_code >= 0)
+    query_code, query_values = pd.factorize(query_ids)
+    group = ts_code.astype(np.int64) * (len(query_values) + 1) + query_code
+    keep = known & top_n_mask(group)
+
+    query_ids = query_ids[keep].astype(np.int64)
+    origin = np.full(len(query_ids), -1, dtype=np.int64)
+    in_range = (query_ids >= 0) & (query_ids < len(ORIGIN_CODE))
+    origin[in_range] = ORIGIN_CODE[query_ids[in_range]]
+    cache = pd.Categorical(cache_cities, dtype=CELLS.city_dtype)[keep].codes.astype(np.int64)
+    valid = (origin >= 0) & (cache >= 0)
+    cache = np.where(cache >= 0, CACHE_CODE[cache], -1)
+    return np.asarray(timestamps)[keep][valid], cache[valid] * n + origin[valid]
+
+
+def cell_counts(cells, weights=None):
+    """Count matrix ``counts[cache_slot, origin_slot]`` over ``LABELS``."""
+    n = len(LABELS)
+    return np.bincount(cells, weights=weights, minlength=n * n).reshape(n, n).astype(np.float64)
+
+
+def origin_cache_counts(timestamps, query_ids, cache_cities):
+    return cell_counts(top_entry_cells(timestamps, query_ids, cache_cities)[1])
+
+
+def region_heatmap(counts, region):
+    """Heatmap frame of ``region``'s cache cities against the origins they served."""
+    caches = REGION_CACHES[region]
+    origins = np.flatnonzero(counts[caches].any(axis=0))
+    slots = np.union1d(caches, origins)
+    # Square over both sets so the diagonal lines up, but only cells of a
+    # regional cache (row) serving an active origin (column) carry counts.
+    values = np.zeros((len(slots), len(slots)))
+    rows, columns = np.searchsorted(slots, caches), np.searchsorted(slots, origins)
+    values[np.ix_(rows, columns)] = counts[np.ix_(caches, origins)]
+    labels = pd.Index(LABELS[slots])
+    return pd.DataFrame(values, index=labels, columns=labels)
+
+
+def _fetch_heatmap_days(key, start, stop):
+    db = get_db()
+    days, ranges = mirror.coverage('cache', start, stop)
+    frames = []
+    if days:
+        df = mirror.read('cache', days, ['timestamp', 'query_id', 'city'])
+        frames.append(df.assign(city=df['city'].astype(CELLS.city_dtype)))
+    for range_start, range_stop in ranges:
+        cursor = db.cache.find({'timestamp': {"$gte": range_start, "$lt": range_stop}}, {'_id': 0, 'city': 1, 'timestamp': 1, 'query_id': 1})
+        frames.append(load_frame(cursor, {'timestamp': 'datetime', 'query_id': 'float64', 'city': CELLS.city_dtype}))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return {}
+    df = pd.concat(frames, ignore_index=True)
+    timestamps, cells = top_entry_cells(df['timestamp'].to_numpy(), df['query_id'].to_numpy(), df['city'].array)
+    days = timestamps.astype('datetime64[D]')
+    parts = {}
+    for day in np.unique(df['timestamp'].to_numpy().astype('datetime64[D]')):
+        in_day = days == day
+        # The midnight sample is kept apart because a range also includes the
+        # first sample of the day after its end date.
+        parts[day.astype(object)] = (
+            np.unique(cells[in_day], return_counts=True),
+            np.unique(cells[in_day & (timestamps == day)], return_counts=True),
+        )
+    return parts
+
+
+@st.cache_resource
+def heatmap_days():
+    return DayCache(_fetch_heatmap_days, shared=shared_backend(), name='heatmap_cells')
+
+
+def region_heatmaps(parts):
+    """Heatmap of every region from the day partials of a range plus the day after it."""
+    counted = [p[0] for p in parts[:-1] if p is not None]
+    if parts[-1] is not None and len(parts[-1][1][0]):
+        counted.append(parts[-1][1])
+    if not counted:
+        return {}
+    cells = np.concatenate([c for c, _ in counted])
+    weights = np.concatenate([w for _, w in counted])
+    counts = cell_counts(cells, weights)
+    return {r: region_heatmap(counts, r) for r in REGION_CACHES}
+
+
+@timed()
+def cache_city_query(start, end, next_midnight=True):
+    """Heatmap of every region over the days ``start`` to ``end``.
+
+    Like the pages' other ranges it takes the first sample of the day after
+    ``end`` too, unless ``next_midnight`` is false.
+    """
+    if not next_midnight:
+        return region_heatmaps([*heatmap_days().get('heatmap', start, end), None])
+    return region_heatmaps(heatmap_days().get('heatmap', start, end + DAY))
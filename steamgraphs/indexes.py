@@ -0,0 +1,194 @@
+"""Indexes the page queries need, and an explain() check of their plans.
+
+Cache load queries match ``type`` and ``city`` or ``region`` exactly and
+``timestamp`` by range, so those indexes put the equality fields first and
+the range last. The fields the aggregations read afterwards (``host``,
+``region``, ``load``) trail the key so the group is answered from the
+index alone; the heatmap fetch is covered the same way.
+
+Create the indexes, then explain every page query shape against the
+newest two days of data::
+
+    python -m steamgraphs.indexes
+    python -m steamgraphs.indexes --explain-only --mongo-uri mongodb://localhost:27017
+
+The explain step reports the plan stages, keys and documents examined,
+and flags collection scans and in-memory sorts. It exits non-zero when a
+query is flagged, so it can gate a deploy.
+"""
+import argparse
+import datetime
+import json
+import sys
+
+from pymongo import ASCENDING, MongoClient
+
+from steamgraphs.cache_load import mean_load_pipeline
+from steamgraphs.cells import CELLS
+from steamgraphs.db import get_db
+from steamgraphs.rollups import CACHE_LOAD, CACHE_SKETCH, RESOLUTIONS, TRAFFIC, rollup_collection, rollup_mean_pipeline
+
+EXPLAIN_SPAN = datetime.timedelta(days=2)
+
+
+def _keys(*fields):
+    return [(f, ASCENDING) for f in fields]
+
+
+INDEXES = {
+    TRAFFIC: [_keys('timestamp')],
+    'cache': [
+        _keys('type', 'city', 'timestamp', 'host', 'load'),
+        _keys('type', 'region', 'timestamp', 'host', 'load'),
+        _keys('timestamp', 'region', 'load'),
+        _keys('timestamp', 'query_id', 'city'),
+    ],
+}
+for resolution in RESOLUTIONS:
+    INDEXES[rollup_collection(TRAFFIC, resolution)] = [_keys('timestamp')]
+    INDEXES[rollup_collection(CACHE_LOAD, resolution)] = [
+        _keys('timestamp'),
+        _keys('type', 'city', 'timestamp'),
+        _keys('type', 'region', 'timestamp'),
+    ]
+    INDEXES[rollup_collection(CACHE_SKETCH, resolution)] = [
+        _keys('timestamp'),
+        _keys('type', 'city', 'timestamp'),
+        _keys('type', 'region', 'timestamp'),
+    ]
+
+
+def ensure_indexes(db=None):
+    """Create every declared index that does not exist yet; returns their names."""
+    db = db if db is not None else get_db()
+    return {name: [db[name].create_index(keys) for keys in indexes] for name, indexes in INDEXES.items()}
+
+
+def query_shapes(start, end):
+    """``(name, collection, command)`` for every query the pages send, over ``start``-``end``."""
+    city = CELLS.cache_cities[0]
+    region = CELLS.cache_regions[0]
+    window = {'$gte': start, '$lt': end}
+    city_match = {'timestamp': window, 'city': city, 'type': 'SteamCache'}
+    region_match = {'timestamp': window, 'region': region, 'type': 'SteamCache'}
+    shapes = [
+        ('traffic_refresh', TRAFFIC,
+         {'find': TRAFFIC, 'filter': {'timestamp': {'$gt': start}}, 'projection': {'_id': 0}, 'sort': {'timestamp': 1}}),
+        ('traffic_bounds', TRAFFIC,
+         {'find': TRAFFIC, 'filter': {}, 'projection': {'_id': 0}, 'sort': {'timestamp': -1}, 'limit': 1}),
+        ('traffic_date', TRAFFIC,
+         {'find': TRAFFIC, 'filter': {'timestamp': window}, 'projection': {'_id': 0}, 'sort': {'timestamp': 1}}),
+        ('heatmap_days', 'cache',
+         {'find': 'cache', 'filter': {'timestamp': window},
+          'projection': {'_id': 0, 'city': 1, 'timestamp': 1, 'query_id': 1}}),
+        ('city_load', 'cache', mean_load_pipeline(city_match, 'host')),
+        ('city_loads', 'cache',
+         mean_load_pipeline({**city_match, 'city': {'$in': list(CELLS.cache_cities[:3])}}, 'host', 'city')),
+        ('region_load', 'cache', mean_load_pipeline(region_match, 'host')),
+        ('region_loads', 'cache',
+         mean_load_pipeline({**region_match, 'region': {'$in': list(CELLS.cache_regions)}}, 'host', 'region')),
+        ('regions_load', 'cache', mean_load_pipeline({'timestamp': window}, 'region')),
+    ]
+    for resolution in RESOLUTIONS:
+        traffic = rollup_collection(TRAFFIC, resolution)
+        cache_load = rollup_collection(CACHE_LOAD, resolution)
+        sketch = rollup_collection(CACHE_SKETCH, resolution)
+        shapes += [
+            (f'traffic_{resolution}', traffic,
+             {'find': traffic, 'filter': {'timestamp': {'$gte': start, '$lte': end}},
+              'projection': {'_id': 0, 'timestamp': 1, 'mean': 1}, 'sort': {'timestamp': 1}}),
+            (f'city_load_{resolution}', cache_load, rollup_mean_pipeline(city_match, 'host')),
+            (f'region_load_{resolution}', cache_load, rollup_mean_pipeline(region_match, 'host')),
+            (f'city_sketch_{resolution}', sketch, {'find': sketch, 'filter': city_match, 'projection': {'_id': 0}}),
+            (f'region_sketch_{resolution}', sketch, {'find': sketch, 'filter': region_match, 'projection': {'_id': 0}}),
+        ]
+    return [(name, collection, query if isinstance(query, dict) else
+             {'aggregate': collection, 'pipeline': query, 'cursor': {}}) for name, collection, query in shapes]
+
+
+def plan_stages(plan):
+    """Stage names of a winning plan, outermost first."""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for key in ('queryPlan', 'inputStage', 'inputStages', 'winningPlan'):
+            if key in plan:
+                stages += plan_stages(plan[key])
+    elif isinstance(plan, list):
+        for p in plan:
+            stages += plan_stages(p)
+    return stages
+
+
+def _find_all(doc, key):
+    if isinstance(doc, dict):
+        for k, v in doc.items():
+            if k == key:
+                yield v
+            else:
+                yield from _find_all(v, key)
+    elif isinstance(doc, list):
+        for v in doc:
+            yield from _find_all(v, key)
+
+
+def summarize_explain(explain):
+    """Stages, examined counts and flags from an ``executionStats`` explain result."""
+    stages = [s for plan in _find_all(explain, 'winningPlan') for s in plan_stages(plan)]
+    stats = list(_find_all(explain, 'executionStats'))
+    flags = []
+    if 'COLLSCAN' in stages:
+        flags.append('collection scan')
+    # Sorting the grouped rows is expected; sorting documents before the
+    # group, or in a plain find, means no index provides the order.
+    group = stages.index('GROUP') if 'GROUP' in stages else -1
+    if any(s == 'SORT' and i > group for i, s in enumerate(stages)):
+        flags.append('in-memory sort')
+    return {
+        'stages': stages,
+        'covered': 'IXSCAN' in stages and 'FETCH' not in stages and 'COLLSCAN' not in stages,
+        'keys_examined': sum(s.get('totalKeysExamined', 0) for s in stats),
+        'docs_examined': sum(s.get('totalDocsExamined', 0) for s in stats),
+        'returned': sum(s.get('nReturned', 0) for s in stats),
+        'flags': flags,
+    }
+
+
+def explain_queries(db=None, span=EXPLAIN_SPAN):
+    """Explain every query shape over the newest ``span`` of data."""
+    db = db if db is not None else get_db()
+    latest = db[TRAFFIC].find_one({}, {'timestamp': 1}, sort=[('timestamp', -1)])
+    end = latest['timestamp'] if latest else datetime.datetime.utcnow()
+    report = {}
+    for name, collection, command in query_shapes(end - span, end):
+        explain = db.command({'explain': command, 'verbosity': 'executionStats'})
+        report[name] = {'collection': collection, **summarize_explain(explain)}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', help='server to use instead of the app secrets')
+    parser.add_argument('--database', default='steam')
+    parser.add_argument('--explain-only', action='store_true', help='do not create indexes')
+    parser.add_argument('--output', help='write the explain report as JSON')
+    args = parser.parse_args(argv)
+
+    db = MongoClient(args.mongo_uri)[args.database] if args.mongo_uri else get_db()
+    if not args.explain_only:
+        for collection, names in ensure_indexes(db).items():
+            print(f"{collection}: {', '.join(names)}")
+    report = explain_queries(db)
+    for name, result in report.items():
+        flags = ', '.join(result['flags']) or 'ok'
+        print(f"{name:>22}: {flags:<32} {' <- '.join(result['stages'])} "
+              f"(keys {result['keys_examined']}, docs {result['docs_examined']}, covered {result['covered']})")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, default=str)
+    return 1 if any(r['flags'] for r in report.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
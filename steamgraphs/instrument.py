@@ -0,0 +1,213 @@
+"""Timing and Mongo traffic of the data and graph functions behind the pages.
+
+Off unless ``STEAMGRAPHS_DIAGNOSTICS`` is set, so normal runs pay nothing:
+
+* ``STEAMGRAPHS_DIAGNOSTICS=1`` keeps the last ``MAX_RECORDS`` calls in
+  memory and shows them in a sidebar panel on every page
+* ``STEAMGRAPHS_DIAGNOSTICS=json`` also logs every call as one JSON line
+  on the ``steamgraphs.diagnostics`` logger
+
+Each record holds the wall time, the commands sent to Mongo with the
+documents and reply bytes they returned, the memory of the returned
+frames and, for ``st.cache_data`` functions, whether the call was a cache
+hit. A hit's time is the argument hashing and lookup overhead; on a miss
+``compute_seconds`` is the time spent in the function body itself.
+
+Figures are handed to Streamlit through ``plotly_chart`` so their
+serialization shows up on its own. Decorate with ``timed`` outside the
+cache decorator and ``record_miss`` inside it::
+
+    @timed('graph')
+    @st.cache_data(ttl=600)
+    @record_miss
+    def graph(df): ...
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import bson
+import pandas as pd
+import streamlit as st
+from pymongo import monitoring
+
+MAX_RECORDS = 2000
+MODE = os.environ.get('STEAMGRAPHS_DIAGNOSTICS', '')
+ENABLED = MODE != ''
+CURSOR_COMMANDS = ('find', 'aggregate', 'getMore')
+
+logger = logging.getLogger('steamgraphs.diagnostics')
+_records = deque(maxlen=MAX_RECORDS)
+_current = contextvars.ContextVar('steamgraphs_span', default=None)
+
+
+class Span:
+
+    def __init__(self, name, kind, parent):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.cache = None
+        self.compute_seconds = None
+        self.commands = 0
+        self.docs_returned = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def add_child(self, span):
+        with self._lock:
+            self.commands += span.commands
+            self.docs_returned += span.docs_returned
+            self.bytes_received += span.bytes_received
+
+    def add_reply(self, docs, size):
+        with self._lock:
+            self.commands += 1
+            self.docs_returned += docs
+            self.bytes_received += size
+
+
+class QueryListener(monitoring.CommandListener):
+    """Adds every successful command's reply to the calling function's span."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        span = _current.get()
+        if span is None:
+            return
+        docs = 0
+        if event.command_name in CURSOR_COMMANDS:
+            cursor = event.reply.get('cursor', {})
+            docs = len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+        span.add_reply(docs, len(bson.encode(event.reply)))
+
+    def failed(self, event):
+        pass
+
+
+def event_listeners():
+    """Listeners to pass to ``MongoClient``; empty when diagnostics are off."""
+    return [QueryListener()] if ENABLED else []
+
+
+def frame_bytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (tuple, list)):
+        return sum(frame_bytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(frame_bytes(v) for v in value.values())
+    return 0
+
+
+def _record(span, started, seconds, result):
+    record = {
+        'name': span.name,
+        'kind': span.kind,
+        'parent': span.parent.name if span.parent else None,
+        'started': started,
+        'seconds': round(seconds, 6),
+        'compute_seconds': None if span.compute_seconds is None else round(span.compute_seconds, 6),
+        'cache': span.cache,
+        'commands': span.commands,
+        'docs_returned': span.docs_returned,
+        'bytes_received': span.bytes_received,
+        'frame_bytes': frame_bytes(result),
+    }
+    _records.append(record)
+    if span.parent is not None:
+        span.parent.add_child(span)
+    if MODE == 'json':
+        logger.info(json.dumps(record))
+
+
+def timed(kind='data', name=None):
+    """Record every call of the decorated function as ``kind``."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+        label = name or fn.__name__
+        # Cached functions report a hit unless record_miss saw the body run.
+        cached = hasattr(fn, 'clear')
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            span = Span(label, kind, _current.get())
+            if cached:
+                span.cache = 'hit'
+            token = _current.set(span)
+            started = time.time()
+            clock = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                _current.reset(token)
+            _record(span, started, time.perf_counter() - clock, result)
+            return result
+
+        if cached:
+            wrapper.clear = fn.clear
+        return wrapper
+    return decorator
+
+
+def record_miss(fn):
+    """Mark the enclosing ``timed`` call as a cache miss when the body runs."""
+    if not ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        span = _current.get()
+        clock = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if span is not None:
+                span.cache = 'miss'
+                span.compute_seconds = time.perf_counter() - clock
+    return wrapper
+
+
+plotly_chart = timed('plotly', 'plotly_chart')(st.plotly_chart)
+
+
+def records():
+    return list(_records)
+
+
+def summary(rows=None):
+    """Per-function call count, hit rate, time and Mongo traffic."""
+    df = pd.DataFrame(records() if rows is None else rows)
+    if df.empty:
+        return df
+    df['hit'] = (df['cache'] == 'hit').astype(float).where(df['cache'].notna())
+    grouped = df.groupby(['kind', 'name'])
+    return pd.DataFrame({
+        'calls': grouped.size(),
+        'hit_rate': grouped['hit'].mean(),
+        'mean_seconds': grouped['seconds'].mean(),
+        'p95_seconds': grouped['seconds'].quantile(0.95),
+        'max_seconds': grouped['seconds'].max(),
+        'docs_returned': grouped['docs_returned'].sum(),
+        'bytes_received': grouped['bytes_received'].sum(),
+        'mean_frame_bytes': grouped['frame_bytes'].mean(),
+    }).sort_values('mean_seconds', ascending=False)
+
+
+def diagnostics_sidebar():
+    """Diagnostics panel in the sidebar, only shown while diagnostics are on."""
+    if not ENABLED:
+        return
+    with st.sidebar.expander('Diagnostics'):
+        st.dataframe(summary())
+        st.download_button('Download records (JSON)', json.dumps(records()), 'diagnostics.json', 'application/json')
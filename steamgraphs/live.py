@@ -0,0 +1,62 @@
+"""Following newly inserted documents for the live charts.
+
+Live charts rerun as Streamlit fragments every ``LIVE_INTERVAL`` seconds.
+Each rerun asks a shared, process-wide tail for new documents; tails
+check the database at most once per ``POLL_INTERVAL`` however many
+sessions are open, so an idle dashboard costs one small query per
+interval.
+
+A live chart from some start date reads its rows at the resolution
+``live_resolution`` picks for the span up to now, so a tail holds at most
+as many rows as a fixed range chart of that span. Tails are kept per
+chart and dropped ``TAIL_TTL`` seconds after they were created.
+"""
+import datetime
+import threading
+import time
+
+import pandas as pd
+from steamgraphs.rollups import as_datetime, resolution_for
+
+LIVE_INTERVAL = 60
+POLL_INTERVAL = 30
+MAX_TAILS = 64
+TAIL_TTL = 3600
+
+
+def live_resolution(since):
+    """Resolution of a live chart from ``since`` (a date or datetime) up to now."""
+    return resolution_for(as_datetime(since), datetime.datetime.utcnow())
+
+
+class Tail:
+    """Rows of ``fetch(start)`` from ``since`` onwards, kept current for live charts.
+
+    ``fetch(start)`` returns the rows with ``timestamp >= start`` sorted by
+    ``timestamp``. The first request loads everything since ``since``;
+    later ones only ask for rows from the newest timestamp held (re-reading
+    that sample or bucket in case it was still being written), at most once
+    per ``poll_interval``.
+    """
+
+    def __init__(self, fetch, since, poll_interval=POLL_INTERVAL):
+        self.fetch = fetch
+        self.since = since
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._rows = None
+        self._checked = None
+
+    def rows(self):
+        with self._lock:
+            if self._rows is None:
+                self._rows = self.fetch(self.since)
+                self._checked = time.monotonic()
+            elif time.monotonic() - self._checked >= self.poll_interval:
+                latest = self._rows['timestamp'].max().to_pydatetime() if not self._rows.empty else self.since
+                new = self.fetch(latest)
+                self._checked = time.monotonic()
+                if not new.empty:
+                    self._rows = pd.concat([self._rows[self._rows['timestamp'] < latest], new], ignore_index=True)
+            return self._rows
+
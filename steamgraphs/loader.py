@@ -0,0 +1,155 @@
+"""Stream a Mongo cursor straight into typed column buffers.
+
+``list(cursor)`` followed by ``pd.DataFrame(items)`` keeps every decoded
+document alive while pandas copies them again into columns, so the peak
+is several times the final frame. ``load_frame`` reads the cursor one
+batch at a time and converts each batch into typed NumPy chunks at once,
+so at most one batch of documents is held besides the columns themselves.
+
+Column kinds:
+
+* ``'datetime'`` – ``datetime64[ns]``, missing values become ``NaT``
+* ``'float32'`` / ``'float64'`` – missing values become ``NaN``
+* ``'category'`` – ``pd.Categorical`` built from integer codes
+* a ``pd.CategoricalDtype`` – codes against its fixed categories, values
+  outside them become missing
+* ``'str'`` – plain object column
+
+A load can be abandoned between batches: when ``CANCEL`` holds an event
+that is set, the cursor is closed and ``Cancelled`` raised (see
+``steamgraphs.progressive``).
+
+Comparing against the old path on a real query::
+
+    python -m steamgraphs.loader
+"""
+import contextvars
+import datetime
+import itertools
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from steamgraphs.db import get_db
+
+BATCH_SIZE = 10_000
+CANCEL = contextvars.ContextVar('cancel', default=None)
+DTYPES = {
+    'datetime': 'datetime64[ns]',
+    'float32': np.float32,
+    'float64': np.float64,
+    'str': object,
+}
+
+
+class _Column:
+
+    def __init__(self, kind, rows_before=0):
+        self.kind = kind
+        self.chunks = []
+        self.categories = {}
+        if isinstance(kind, pd.CategoricalDtype):
+            self.categories = {c: i for i, c in enumerate(kind.categories)}
+        if rows_before:
+            self.chunks.append(self._convert([None] * rows_before))
+
+    def _convert(self, values):
+        if isinstance(self.kind, pd.CategoricalDtype):
+            categories = self.categories
+            return np.array([categories.get(v, -1) for v in values], dtype=np.int32)
+        if self.kind == 'category':
+            categories = self.categories
+            return np.array([-1 if v is None else categories.setdefault(v, len(categories)) for v in values],
+                            dtype=np.int32)
+        return np.array(values, dtype=DTYPES[self.kind])
+
+    def append(self, values):
+        self.chunks.append(self._convert(values))
+
+    def finish(self):
+        values = np.concatenate(self.chunks) if self.chunks else self._convert([])
+        if isinstance(self.kind, pd.CategoricalDtype):
+            return pd.Categorical.from_codes(values, dtype=self.kind)
+        if self.kind == 'category':
+            return pd.Categorical.from_codes(values, categories=list(self.categories))
+        return values
+
+
+class Cancelled(Exception):
+    """A load was abandoned because a newer request superseded it."""
+
+
+def _check_cancelled(cursor):
+    cancel = CANCEL.get()
+    if cancel is not None and cancel.is_set():
+        if hasattr(cursor, 'close'):
+            cursor.close()
+        raise Cancelled()
+
+
+def load_frame(cursor, columns, rest=None, index=None, batch_size=BATCH_SIZE):
+    """Read ``cursor`` into a DataFrame with the column kinds in ``columns``.
+
+    Fields not named in ``columns`` are dropped, or loaded with kind
+    ``rest`` when given (e.g. the per-region fields of ``global_bandwidth``).
+    ``index`` names a column to use as the index.
+    """
+    if hasattr(cursor, 'batch_size'):
+        cursor.batch_size(batch_size)
+    buffers = {name: _Column(kind) for name, kind in columns.items()}
+    rows = 0
+    iterator = iter(cursor)
+    while True:
+        _check_cancelled(cursor)
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            break
+        if rest is not None:
+            for name in dict.fromkeys(k for doc in batch for k in doc):
+                if name not in buffers:
+                    buffers[name] = _Column(rest, rows)
+        for name, column in buffers.items():
+            column.append([doc.get(name) for doc in batch])
+        rows += len(batch)
+    df = pd.DataFrame({name: column.finish() for name, column in buffers.items()})
+    if index is not None:
+        df.set_index(index, inplace=True)
+    return df
+
+
+def compare_with_list_path(collection, query, projection, columns, rest=None):
+    """Time and peak traced memory of ``list(find())`` + ``DataFrame`` vs ``load_frame``."""
+    def measure(load):
+        tracemalloc.start()
+        started = time.perf_counter()
+        df = load()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            'seconds': round(elapsed, 4),
+            'peak_bytes': peak,
+            'frame_bytes': int(df.memory_usage(deep=True).sum()),
+            'rows': len(df),
+        }
+
+    return {
+        'list_dataframe': measure(lambda: pd.DataFrame(list(collection.find(query, projection)))),
+        'load_frame': measure(lambda: load_frame(collection.find(query, projection), columns, rest)),
+    }
+
+
+if __name__ == '__main__':
+    db = get_db()
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=7)
+    report = compare_with_list_path(
+        db.cache,
+        {'timestamp': {'$gte': since}},
+        {'_id': 0, 'timestamp': 1, 'host': 1, 'city': 1, 'region': 1, 'load': 1},
+        {'timestamp': 'datetime', 'host': 'category', 'city': 'category', 'region': 'category', 'load': 'float32'},
+    )
+    for path, stats in report.items():
+        print(f"{path:>15}: {stats['rows']} rows in {stats['seconds']:.3f}s, "
+              f"peak {stats['peak_bytes'] / 2**20:.1f} MiB, frame {stats['frame_bytes'] / 2**20:.1f} MiB")
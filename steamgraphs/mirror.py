@@ -0,0 +1,186 @@
+"""Day-partitioned Parquet mirror of ``global_bandwidth`` and ``cache``.
+
+A day never changes once it has passed, so complete days are copied once
+into ``<root>/<collection>/<YYYY-MM-DD>.parquet`` and read from there
+instead of Mongo. ``manifest.json`` in each collection directory records
+the synced span, so a day without a file in it is known to be empty::
+
+    python -m steamgraphs.mirror --root /var/lib/steamgraphs/mirror
+
+Each run appends the days completed since the last one. With
+``STEAMGRAPHS_MIRROR`` pointing at the root, the traffic and cache load
+day caches and the heatmap read the synced days from the mirror, pruned
+to the days asked for and memory-mapped, and only query Mongo for the
+rest, normally just today. The files also load directly in
+pandas for offline analysis.
+
+pyarrow is only needed with a mirror, so it is imported when one is
+synced or read, not by the pages importing this module.
+"""
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from steamgraphs.db import get_db
+from steamgraphs.loader import load_frame
+from steamgraphs.range_cache import DAY, SETTLE
+
+ENV = 'STEAMGRAPHS_MIRROR'
+SCHEMAS = {
+    'global_bandwidth': ({'timestamp': 'datetime'}, 'float64'),
+    'cache': ({
+        'timestamp': 'datetime',
+        'query_id': 'float64',
+        'city': 'category',
+        'region': 'category',
+        'host': 'category',
+        'type': 'category',
+        'load': 'float32',
+    }, None),
+}
+
+
+def mirror_root():
+    root = os.environ.get(ENV)
+    return Path(root) if root else None
+
+
+def partition_path(root, collection, day):
+    return Path(root) / collection / f'{day.isoformat()}.parquet'
+
+
+def _manifest_path(root, collection):
+    return Path(root) / collection / 'manifest.json'
+
+
+def synced_span(root, collection):
+    """``(first, through)`` dates synced for ``collection``, or ``None``."""
+    path = _manifest_path(root, collection)
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+    return datetime.date.fromisoformat(manifest['first']), datetime.date.fromisoformat(manifest['through'])
+
+
+def _write_manifest(root, collection, first, through):
+    path = _manifest_path(root, collection)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as file:
+        json.dump({'first': first.isoformat(), 'through': through.isoformat()}, file)
+    os.replace(tmp, path)
+
+
+def _day_frame(db, collection, day):
+    start = datetime.datetime.combine(day, datetime.time())
+    columns, rest = SCHEMAS[collection]
+    cursor = db[collection].find({'timestamp': {'$gte': start, '$lt': start + DAY}},
+                                 {'_id': 0, **({} if rest else {c: 1 for c in columns})})
+    return load_frame(cursor, columns, rest)
+
+
+def sync_collection(db, root, collection, now=None):
+    """Copy every complete day after the synced span; returns the days written."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    now = now or datetime.datetime.utcnow()
+    last_complete = (now - SETTLE).date() - DAY
+    span = synced_span(root, collection)
+    if span is None:
+        oldest = db[collection].find_one({}, {'timestamp': 1}, sort=[('timestamp', 1)])
+        if oldest is None:
+            return []
+        first, day = oldest['timestamp'].date(), oldest['timestamp'].date()
+    else:
+        first, day = span[0], span[1] + DAY
+    (Path(root) / collection).mkdir(parents=True, exist_ok=True)
+    written = []
+    while day <= last_complete:
+        df = _day_frame(db, collection, day)
+        if not df.empty:
+            path = partition_path(root, collection, day)
+            tmp = path.with_suffix('.tmp')
+            # Row order is kept: the heatmap ranks caches by it.
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp, compression='zstd')
+            os.replace(tmp, path)
+            written.append(day)
+        _write_manifest(root, collection, first, day)
+        day += DAY
+    return written
+
+
+def sync(db=None, root=None):
+    db = db if db is not None else get_db()
+    root = root or mirror_root()
+    return {collection: sync_collection(db, root, collection) for collection in SCHEMAS}
+
+
+def coverage(collection, start, stop, root=None):
+    """Split ``[start, stop)`` into mirrored whole days and datetime ranges left for Mongo."""
+    root = root or mirror_root()
+    span = synced_span(root, collection) if root else None
+    if span is None:
+        return [], [(start, stop)]
+    first, through = span
+    days, ranges = [], []
+    cursor = start
+    day = start.date()
+    while datetime.datetime.combine(day, datetime.time()) < stop:
+        day_start = datetime.datetime.combine(day, datetime.time())
+        whole = day_start >= start and day_start + DAY <= stop
+        if whole and first <= day <= through:
+            if cursor < day_start:
+                ranges.append((cursor, day_start))
+            days.append(day)
+            cursor = day_start + DAY
+        day += DAY
+    if cursor < stop:
+        ranges.append((cursor, stop))
+    return days, ranges
+
+
+def _filters(where):
+    filters = []
+    for field, value in (where or {}).items():
+        if isinstance(value, dict) and '$in' in value:
+            filters.append((field, 'in', list(value['$in'])))
+        else:
+            filters.append((field, '==', value))
+    return filters or None
+
+
+def read(collection, days, columns=None, where=None, root=None):
+    """Rows of the mirrored ``days``, optionally only ``columns`` and rows matching ``where``.
+
+    ``where`` takes the equality and ``$in`` conditions of a Mongo match.
+    """
+    import pyarrow.parquet as pq
+
+    root = root or mirror_root()
+    frames = []
+    for day in days:
+        path = partition_path(root, collection, day)
+        if path.exists():
+            table = pq.read_table(path, columns=columns, filters=_filters(where), memory_map=True)
+            frames.append(table.to_pandas())
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--root', default=os.environ.get(ENV), required=ENV not in os.environ)
+    args = parser.parse_args(argv)
+    for collection, days in sync(root=args.root).items():
+        print(f"{collection}: {len(days)} days written"
+              + (f" ({days[0]} to {days[-1]})" if days else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""Progressive, cancellable loading of wide date ranges.
+
+A chart whose range has more than one chunk of days left to fetch is
+drawn from a cheap preview first (the next coarser rollup for the city
+load chart, read directly and without filling any day cache; ranges
+already at daily resolution have none), then redrawn as the missing days
+arrive, newest chunk first, behind a progress bar. The preview runs on
+the same pool and under the same cancellation as the chunks. Chunks are fetched on a small pool
+that works at most ``AHEAD`` chunks ahead of the page, and each lands in
+the same day cache the final ``figure_spec`` reads, so the last draw is
+a cache lookup.
+
+Changing a widget makes Streamlit stop the running script at its next
+``st`` call. ``ChunkLoader`` updates the progress bar while it waits, so
+that happens within ``POLL`` seconds, and on the way out it drops the
+queued chunks and sets the event ``load_frame`` checks between batches
+(``steamgraphs.loader.CANCEL``), closing the cursors of running ones. A
+new load of the same chart in the same session also cancels one still
+running from an earlier run.
+"""
+import concurrent.futures
+import contextvars
+import datetime
+import itertools
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from steamgraphs.cache_load import _city_frame, _day_cache_key, mean_load_days, rollup_mean_load_rows
+from steamgraphs.cells import CELLS
+from steamgraphs.figures import city_load_figure, heatmap_figure
+from steamgraphs.heatmap import heatmap_days, region_heatmaps
+from steamgraphs.instrument import plotly_chart
+from steamgraphs.loader import CANCEL, Cancelled
+from steamgraphs.range_cache import DAY
+from steamgraphs.rollups import resolution_for
+from steamgraphs.traffic import traffic_range
+
+CHUNK_DAYS = {'raw': 1, 'hourly': 7, 'daily': 28}
+# Rollup read for the preview of a range at each resolution; daily has none.
+COARSER = {'raw': 'hourly', 'hourly': 'daily'}
+AHEAD = 2
+POLL = 0.25
+
+_running = {}
+_running_lock = threading.Lock()
+
+
+def day_chunks(runs, days):
+    """Split ``(first, last)`` day runs into chunks of at most ``days`` days, newest first."""
+    chunks = []
+    for first, last in reversed(runs):
+        while last >= first:
+            chunk_first = max(first, last - (days - 1) * DAY)
+            chunks.append((chunk_first, last))
+            last = chunk_first - DAY
+    return chunks
+
+
+class ChunkLoader:
+    """Fetch ``fetch(first, last)`` for each chunk on a pool, yielding the results in order.
+
+    Use as a context manager; leaving it cancels what is still queued or
+    running. ``name`` identifies the chart, so a newer loader for it in
+    the same session cancels this one.
+    """
+
+    def __init__(self, fetch, chunks, name=None, ahead=AHEAD):
+        self.fetch = fetch
+        self.chunks = chunks
+        self.ahead = ahead
+        self.cancelled = threading.Event()
+        ctx = get_script_run_ctx()
+        self._ctx = ctx
+        self._key = None if name is None or ctx is None else (ctx.session_id, name)
+        self._pool = None
+        self._futures = []
+
+    def __enter__(self):
+        if self._key is not None:
+            with _running_lock:
+                previous = _running.get(self._key)
+                _running[self._key] = self
+            if previous is not None:
+                previous.cancel()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.ahead, thread_name_prefix='chunk')
+        return self
+
+    def __exit__(self, *exc):
+        self.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._key is not None:
+            with _running_lock:
+                if _running.get(self._key) is self:
+                    del _running[self._key]
+        return False
+
+    def cancel(self):
+        self.cancelled.set()
+        for future in self._futures:
+            future.cancel()
+
+    def _submit(self, fn, *args):
+        ctx = self._ctx
+        context = contextvars.copy_context()
+
+        def call():
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), ctx)
+            CANCEL.set(self.cancelled)
+            return fn(*args)
+
+        future = self._pool.submit(context.run, call)
+        self._futures.append(future)
+        return future
+
+    def _wait(self, future, wait):
+        while not concurrent.futures.wait([future], timeout=POLL).done:
+            if self.cancelled.is_set():
+                raise Cancelled()
+            if wait is not None:
+                wait()
+        return future.result()
+
+    def run(self, fn, wait=None):
+        """``fn()`` on the pool, cancelled with the chunks; ``wait()`` is called every ``POLL`` seconds."""
+        return self._wait(self._submit(fn), wait)
+
+    def results(self, wait=None):
+        """``(chunk, result)`` pairs in chunk order; ``wait()`` is called every ``POLL`` seconds while waiting."""
+        chunks = iter(self.chunks)
+        pending = deque((chunk, self._submit(self.fetch, *chunk)) for chunk in itertools.islice(chunks, self.ahead))
+        while pending:
+            chunk, future = pending.popleft()
+            result = self._wait(future, wait)
+            following = next(chunks, None)
+            if following is not None:
+                pending.append((following, self._submit(self.fetch, *following)))
+            yield chunk, result
+
+
+def load_chunks(fetch, chunks, draw, name, label, preview=None):
+    """Run ``fetch`` over ``chunks`` behind a progress bar, calling ``draw(step)`` after each but the last.
+
+    ``preview()``, if given, runs first on the same pool and is followed
+    by ``draw(0)``.
+    """
+    progress = st.progress(0.0, text=label)
+    started = time.monotonic()
+    done = 0
+
+    def tick():
+        progress.progress(done / len(chunks),
+                          text=f'{label}: {done} of {len(chunks)} chunks, {time.monotonic() - started:.0f} s')
+
+    try:
+        with ChunkLoader(fetch, chunks, name) as loader:
+            if preview is not None:
+                loader.run(preview, tick)
+                draw(0)
+            for _ in loader.results(tick):
+                done += 1
+                tick()
+                if done < len(chunks):
+                    draw(done)
+    except Cancelled:
+        # Superseded by a newer run of this page in the same session.
+        st.stop()
+    progress.empty()
+
+
+def _missing_chunks(cache, key, first, last, resolution):
+    chunks = day_chunks(cache.missing_runs(key, first, last), CHUNK_DAYS[resolution])
+    return chunks if len(chunks) > 1 else []
+
+
+def city_load_progressively(placeholder, city, start, end, overlay_region, full_resolution):
+    """Fill the city load chart's days in chunks, redrawing it in ``placeholder`` as they arrive.
+
+    Returns at once when at most one chunk is missing. Days not loaded yet
+    are drawn from the next coarser rollup, if there is one.
+    """
+    resolution = resolution_for(start, end)
+    filters = {'city': city, 'type': 'SteamCache'}
+    key = _day_cache_key(filters, 'host', resolution)
+    cache = mean_load_days()
+    chunks = _missing_chunks(cache, key, start, end, resolution)
+    if not chunks:
+        return
+    s = datetime.datetime.combine(start, datetime.time())
+    e = datetime.datetime.combine(end, datetime.time())
+    coarse = []
+    region = CELLS.region_of(city)
+    traffic_df = traffic_range(start, end) if overlay_region else None
+
+    def preview():
+        match = {'timestamp': {'$gte': s, '$lt': e + DAY}, **filters}
+        coarse.append(rollup_mean_load_rows(match, 'host', COARSER[resolution]))
+
+    def draw(step):
+        loaded = cache.peek(key, start, end)
+        parts = [p for p in loaded.values() if p is not None]
+        parts += [c[~c['timestamp'].dt.date.isin(list(loaded))] for c in coarse]
+        if not parts:
+            return
+        df = pd.concat(parts, ignore_index=True).sort_values('timestamp', kind='stable')
+        rows, dates, hosts, down = _city_frame(df[(df['timestamp'] >= s) & (df['timestamp'] <= e)])
+        if rows.empty:
+            return
+        fig = city_load_figure(rows, dates, hosts, down, overlay_region, region, traffic_df, full_resolution)
+        with placeholder:
+            plotly_chart(fig, use_container_width=True, key=f'city_load_progress_{step}')
+
+    load_chunks(lambda first, last: cache.get(key, first, last), chunks, draw, 'city_load',
+                f'Loading {city} {resolution} data', preview if resolution in COARSER else None)
+
+
+def heatmap_progressively(placeholder, region, start, end):
+    """Fill the heatmap's days in chunks, newest first, redrawing ``region``'s heatmap as they arrive.
+
+    Returns at once when at most one chunk is missing; with no ``region``
+    the days are only loaded.
+    """
+    cache = heatmap_days()
+    chunks = _missing_chunks(cache, 'heatmap', start, end + DAY, 'raw')
+    if not chunks:
+        return
+
+    def draw(step):
+        if region is None:
+            return
+        loaded = cache.peek('heatmap', start, end + DAY)
+        days = [start + i * DAY for i in range((end - start).days + 2)]
+        df = region_heatmaps([loaded.get(day) for day in days]).get(region.replace(' ', '_'))
+        if df is None:
+            return
+        with placeholder:
+            plotly_chart(heatmap_figure(df), use_container_width=True, key=f'heatmap_progress_{step}')
+
+    load_chunks(lambda first, last: cache.get('heatmap', first, last), chunks, draw, 'heatmap',
+                'Loading cache queries')
@@ -0,0 +1,151 @@
+"""Day-partitioned cache for date range queries.
+
+Range queries are answered from per-day partial results. Only days that are
+not cached yet are fetched, in one query per contiguous run of missing
+days. A day that ended more than ``SETTLE`` ago never changes once
+collected and is kept until the cache is full; a more recent day (today,
+and yesterday during the first ``SETTLE`` after midnight UTC) is
+refetched once ``today_ttl`` seconds have passed.
+
+With a ``shared`` store (see ``steamgraphs.shared_cache``) missing days
+are looked up there before they are fetched, and fetched days are written
+back, so other processes only query Mongo for days nobody has fetched.
+"""
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+DAY = datetime.timedelta(days=1)
+# Samples of a day may still land this long after it ended.
+SETTLE = datetime.timedelta(hours=1)
+
+
+def first_unsettled_day():
+    """The oldest day that may still receive samples; every day before it is final."""
+    return (datetime.datetime.utcnow() - SETTLE).date()
+
+
+def _day_runs(days):
+    """Group sorted dates into ``(first, last)`` runs of consecutive days."""
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] == day - DAY:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(r) for r in runs]
+
+
+def _days(first, last):
+    day = first
+    while day <= last:
+        yield day
+        day += DAY
+
+
+def _bounds(first, last):
+    return datetime.datetime.combine(first, datetime.time()), datetime.datetime.combine(last + DAY, datetime.time())
+
+
+class DayCache:
+    """Per-day partials of ``fetch(key, start, stop)`` results.
+
+    ``fetch`` receives a half-open datetime range covering whole days and
+    returns ``{date: partial}``; days missing from the result are cached as
+    ``None`` (no data).
+    """
+
+    def __init__(self, fetch, today_ttl=600, max_partials=100_000, shared=None, name=None):
+        self._fetch = fetch
+        self.today_ttl = today_ttl
+        self.max_partials = max_partials
+        self.shared = shared
+        self.name = name or fetch.__name__
+        self._partials = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key, day, unsettled, now):
+        entry = self._partials.get((key, day))
+        if entry is None:
+            return False
+        fetched_at, _ = entry
+        return day < unsettled or now - fetched_at < self.today_ttl
+
+    def missing_runs(self, key, first, last):
+        """Contiguous ``(first, last)`` day runs that need fetching."""
+        unsettled, now = first_unsettled_day(), time.monotonic()
+        with self._lock:
+            missing = [d for d in _days(first, last) if not self._cached(key, d, unsettled, now)]
+        if missing and self.shared is not None:
+            found = self._shared_days(key, missing)
+            if found:
+                self._put(key, found)
+                missing = [d for d in missing if d not in found]
+        return _day_runs(missing)
+
+    def _put(self, key, parts):
+        now = time.monotonic()
+        with self._lock:
+            for day, part in parts.items():
+                self._partials[(key, day)] = (now, part)
+                self._partials.move_to_end((key, day))
+            while len(self._partials) > self.max_partials:
+                self._partials.popitem(last=False)
+
+    def store(self, key, first, last, parts):
+        """Cache ``parts`` (``{date: partial}``) as the result for days ``first`` to ``last``."""
+        parts = {day: parts.get(day) for day in _days(first, last)}
+        self._put(key, parts)
+        if self.shared is not None:
+            unsettled = first_unsettled_day()
+            for day, part in parts.items():
+                self.shared.set(self._shared_key(key, day), (part,), None if day < unsettled else self.today_ttl)
+
+    def get(self, key, first, last):
+        """Partials for every day from ``first`` to ``last`` inclusive, in order."""
+        for run_first, run_last in self.missing_runs(key, first, last):
+            if self.shared is None:
+                self.store(key, run_first, run_last, self._fetch(key, *_bounds(run_first, run_last)))
+            else:
+                self._fill_shared(key, run_first, run_last)
+        with self._lock:
+            result = []
+            for day in _days(first, last):
+                entry = self._partials.get((key, day))
+                if entry is not None:
+                    self._partials.move_to_end((key, day))
+                result.append(None if entry is None else entry[1])
+            return result
+
+    def peek(self, key, first, last):
+        """``{date: partial}`` of the days from ``first`` to ``last`` cached in this process; nothing is fetched."""
+        unsettled, now = first_unsettled_day(), time.monotonic()
+        with self._lock:
+            return {day: self._partials[(key, day)][1] for day in _days(first, last)
+                    if self._cached(key, day, unsettled, now)}
+
+    def _shared_key(self, key, day):
+        return f'{self.name}:{key!r}:{day.isoformat()}'
+
+    def _shared_days(self, key, days):
+        # Entries are 1-tuples so a cached day without data (None) is a hit.
+        found = {}
+        for day in days:
+            entry = self.shared.get(self._shared_key(key, day))
+            if entry is not None:
+                found[day] = entry[0]
+        return found
+
+    def _fill_shared(self, key, first, last):
+        # One process fetches a run; the others wait, then read its days.
+        with self.shared.lock(f'{self._shared_key(key, first)}:{last.isoformat()}'):
+            found = self._shared_days(key, _days(first, last))
+            if len(found) > (last - first).days:
+                self._put(key, found)
+            else:
+                self.store(key, first, last, self._fetch(key, *_bounds(first, last)))
+
+    def clear(self):
+        with self._lock:
+            self._partials.clear()
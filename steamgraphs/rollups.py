@@ -0,0 +1,232 @@
+"""Hourly and daily rollups of ``global_bandwidth`` and ``cache``.
+
+Rollups live next to the raw data in ``<collection>_hourly`` and
+``<collection>_daily`` and hold the mean, max and sample count of every
+bucket. ``cache_sketch_<resolution>`` holds a load histogram per bucket and
+city, see ``steamgraphs.sketches``.
+
+``rollup_state`` records for every rollup collection the start of its
+newest bucket as of the last run that finished. Buckets before that mark
+are complete and readers take them from the rollup; later ones are read
+from the raw data. ``update_rollups`` re-aggregates with upserts from
+the bucket ``SETTLE`` before the mark, so buckets that received late
+samples are redone, and gaps left by an interrupted run are filled by the
+next one. It is cheap to run after every collection round::
+
+    python -m steamgraphs.rollups
+"""
+import datetime
+
+from pymongo import InsertOne, ReplaceOne
+
+from steamgraphs.db import get_db
+from steamgraphs.loader import load_frame
+from steamgraphs.range_cache import SETTLE
+from steamgraphs.sketches import sketch_docs
+
+RESOLUTIONS = ('hourly', 'daily')
+RAW_MAX_SPAN = datetime.timedelta(days=7)
+HOURLY_MAX_SPAN = datetime.timedelta(days=62)
+TRAFFIC = 'global_bandwidth'
+CACHE_LOAD = 'cache_load'
+CACHE_SKETCH = 'cache_sketch'
+SKETCH_COLUMNS = {
+    'timestamp': 'datetime',
+    'type': 'category',
+    'city': 'category',
+    'region': 'category',
+    'host': 'category',
+    'load': 'float32',
+}
+BATCH_SIZE = 1000
+FREQ = {'hourly': 'h', 'daily': 'D'}
+BUCKET = {'hourly': datetime.timedelta(hours=1), 'daily': datetime.timedelta(days=1)}
+STATE = 'rollup_state'
+
+
+def resolution_for(start, end):
+    span = end - start
+    if span <= RAW_MAX_SPAN:
+        return 'raw'
+    if span <= HOURLY_MAX_SPAN:
+        return 'hourly'
+    return 'daily'
+
+
+def rollup_collection(name, resolution):
+    return f'{name}_{resolution}'
+
+
+def as_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.combine(value, datetime.time())
+
+
+def bucket_start(timestamp, resolution):
+    """Start of the ``resolution`` bucket holding ``timestamp``."""
+    if resolution == 'daily':
+        return datetime.datetime.combine(timestamp.date(), datetime.time())
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_expression(resolution):
+    parts = {
+        'year': {'$year': '$timestamp'},
+        'month': {'$month': '$timestamp'},
+        'day': {'$dayOfMonth': '$timestamp'},
+    }
+    if resolution == 'hourly':
+        parts['hour'] = {'$hour': '$timestamp'}
+    return {'$dateFromParts': parts}
+
+
+def rollup_mean_pipeline(match, key, split=None):
+    """Sample-weighted mean ``load`` per bucket and ``key`` from a cache rollup.
+
+    Produces the same rows as the raw pipeline in ``steamgraphs.cache_load``
+    so both feed the same frame builders.
+    """
+    fields = [key] if split is None else [key, split]
+    return [
+        {'$match': match},
+        {'$group': {
+            '_id': {'timestamp': '$timestamp', **{f: f'${f}' for f in fields}},
+            'total': {'$sum': {'$multiply': ['$mean', '$count']}},
+            'count': {'$sum': '$count'},
+        }},
+        {'$project': {'_id': 0, 'timestamp': '$_id.timestamp', **{f: f'$_id.{f}' for f in fields},
+                      'load': {'$divide': ['$total', '$count']}}},
+        {'$sort': {'timestamp': 1, key: 1}},
+    ]
+
+
+def rollup_through(collection):
+    """High-water mark of a rollup collection, or ``None`` before its first finished run.
+
+    Buckets before it are complete. The bucket at the mark may have been
+    partial when it was written, so it and anything later are read from
+    the raw collection.
+    """
+    state = collection.database[STATE].find_one({'_id': collection.name})
+    return None if state is None else state['through']
+
+
+def split_match(match, through):
+    """``match``, whose timestamp is a ``$gte``/``$lt`` range, split at ``through``.
+
+    Returns ``(rollup, raw)`` matches for the parts before and from
+    ``through``; a part that is empty is ``None``. Without ``$lt`` the
+    range is open-ended.
+    """
+    start, stop = match['timestamp']['$gte'], match['timestamp'].get('$lt')
+    if through is None or through <= start:
+        return None, match
+    if stop is not None and through >= stop:
+        return match, None
+    rest = {'$gte': through} if stop is None else {'$gte': through, '$lt': stop}
+    return {**match, 'timestamp': {'$gte': start, '$lt': through}}, {**match, 'timestamp': rest}
+
+
+def _resume_from(collection, resolution):
+    through = rollup_through(collection)
+    if through is None:
+        return {}
+    # Samples may land up to SETTLE late, into buckets already written.
+    return {'timestamp': {'$gte': bucket_start(through - SETTLE, resolution)}}
+
+
+def _mark_through(collection):
+    latest = collection.find_one({}, {'timestamp': 1}, sort=[('timestamp', -1)])
+    if latest is not None:
+        collection.database[STATE].replace_one({'_id': collection.name},
+                                               {'_id': collection.name, 'through': latest['timestamp']}, upsert=True)
+
+
+def _write(collection, docs, upsert):
+    written = 0
+    batch = []
+    for doc in docs:
+        batch.append(ReplaceOne({'_id': doc['_id']}, doc, upsert=True) if upsert else InsertOne(doc))
+        if len(batch) == BATCH_SIZE:
+            collection.bulk_write(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+        written += len(batch)
+    return written
+
+
+def _traffic_docs(db, resolution, match):
+    latest = db[TRAFFIC].find_one({}, {'_id': 0}, sort=[('timestamp', -1)])
+    if latest is None:
+        return
+    regions = [k for k in latest if k != 'timestamp']
+    group = {'_id': bucket_expression(resolution), 'count': {'$sum': 1}}
+    for r in regions:
+        group[f'mean_{r}'] = {'$avg': f'${r}'}
+        group[f'max_{r}'] = {'$max': f'${r}'}
+    for row in db[TRAFFIC].aggregate([{'$match': match}, {'$group': group}], allowDiskUse=True):
+        yield {
+            '_id': row['_id'],
+            'timestamp': row['_id'],
+            'count': row['count'],
+            'mean': {r: row[f'mean_{r}'] for r in regions},
+            'max': {r: row[f'max_{r}'] for r in regions},
+        }
+
+
+def _cache_load_docs(db, resolution, match):
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': {
+                'timestamp': bucket_expression(resolution),
+                'host': '$host',
+                'type': '$type',
+                'city': '$city',
+                'region': '$region',
+            },
+            'mean': {'$avg': '$load'},
+            'max': {'$max': '$load'},
+            'count': {'$sum': 1},
+        }},
+    ]
+    for row in db.cache.aggregate(pipeline, allowDiskUse=True):
+        yield {**row, **row['_id']}
+
+
+def _cache_sketch_docs(db, resolution, match):
+    # Raw samples are read one day at a time to bound memory on a first build.
+    first = db.cache.find_one(match, {'timestamp': 1}, sort=[('timestamp', 1)])
+    last = db.cache.find_one(match, {'timestamp': 1}, sort=[('timestamp', -1)])
+    if first is None:
+        return
+    start = first['timestamp']
+    while start <= last['timestamp']:
+        stop = datetime.datetime.combine(start.date(), datetime.time()) + datetime.timedelta(days=1)
+        cursor = db.cache.find({'timestamp': {'$gte': start, '$lt': stop}}, {'_id': 0, **{c: 1 for c in SKETCH_COLUMNS}})
+        yield from sketch_docs(load_frame(cursor, SKETCH_COLUMNS), resolution)
+        start = stop
+
+
+def update_rollups(db=None):
+    """Bring every rollup collection up to date and return the rows written."""
+    db = db if db is not None else get_db()
+    written = {}
+    for name, docs in ((TRAFFIC, _traffic_docs), (CACHE_LOAD, _cache_load_docs), (CACHE_SKETCH, _cache_sketch_docs)):
+        for resolution in RESOLUTIONS:
+            target = db[rollup_collection(name, resolution)]
+            target.create_index('timestamp')
+            match = _resume_from(target, resolution)
+            # An empty rollup has nothing to replace, so plain inserts are enough.
+            upsert = target.find_one({}, {'_id': 1}) is not None
+            written[target.name] = _write(target, docs(db, resolution, match), upsert)
+            _mark_through(target)
+    return written
+
+
+if __name__ == '__main__':
+    for collection, count in update_rollups().items():
+        print(f'{collection}: {count} buckets written')
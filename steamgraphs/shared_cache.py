@@ -0,0 +1,156 @@
+"""Cache shared between Streamlit processes and replicas on one host.
+
+Streamlit's caches live inside one process, so every worker fetches the
+same history and recomputes the same heatmap days. When
+``STEAMGRAPHS_SHARED_CACHE`` names a store, e.g.
+``sqlite:/var/cache/steamgraphs.db``, the day caches are also kept
+there and a worker fills its own caches from them before asking
+Mongo. Without it nothing changes.
+
+Values are pickled and zlib-compressed. Entries expire after their TTL
+and the least recently read ones are evicted once the store is larger
+than ``max_bytes``. ``lock`` gives single-flight computation across
+processes: the first worker to miss a key computes it while the others
+wait and then read its result.
+
+The store is trusted like the app's own files, since entries are pickles.
+Another backend (Redis, say) only needs ``get``, ``set``, ``lock`` and
+``clear``.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+ENV = 'STEAMGRAPHS_SHARED_CACHE'
+MAX_BYTES = 512 * 2**20
+LOCK_TIMEOUT = 300
+LOCK_POLL = 0.1
+
+
+def dumps(value):
+    return zlib.compress(pickle.dumps(value, protocol=5), 1)
+
+
+def loads(data):
+    return pickle.loads(zlib.decompress(data))
+
+
+class SQLiteBackend:
+
+    def __init__(self, path, max_bytes=MAX_BYTES, lock_timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        self._local = threading.local()
+        self._db().executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, accessed REAL);
+            CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+            CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, expires REAL);
+        """)
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def get(self, key):
+        db = self._db()
+        row = db.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        now = time.time()
+        if expires is not None and expires <= now:
+            db.execute('DELETE FROM entries WHERE key = ? AND expires <= ?', (key, now))
+            return None
+        db.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return loads(value)
+
+    def set(self, key, value, ttl=None):
+        data = dumps(value)
+        now = time.time()
+        db = self._db()
+        db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                   (key, data, len(data), None if ttl is None else now + ttl, now))
+        self._evict(db)
+
+    def _evict(self, db):
+        db.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),))
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        keys = []
+        for key, size in db.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        db.executemany('DELETE FROM entries WHERE key = ?', keys)
+
+    @contextmanager
+    def lock(self, key):
+        """Hold ``key`` against every other process using this store.
+
+        A lock left behind by a crashed worker expires after ``lock_timeout``.
+        """
+        db = self._db()
+        while True:
+            now = time.time()
+            db.execute('DELETE FROM locks WHERE key = ? AND expires <= ?', (key, now))
+            if db.execute('INSERT OR IGNORE INTO locks VALUES (?, ?)', (key, now + self.lock_timeout)).rowcount:
+                break
+            time.sleep(LOCK_POLL)
+        try:
+            yield
+        finally:
+            db.execute('DELETE FROM locks WHERE key = ?', (key,))
+
+    def clear(self):
+        self._db().execute('DELETE FROM entries')
+
+
+def open_backend(url):
+    scheme, _, location = url.partition(':')
+    if scheme == 'sqlite':
+        return SQLiteBackend(location)
+    raise ValueError(f'unsupported shared cache {url!r}')
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def shared_backend():
+    """The configured shared store, or ``None`` to keep caching in-process only."""
+    global _backend
+    url = os.environ.get(ENV)
+    if not url:
+        return None
+    with _backend_lock:
+        if _backend is None:
+            _backend = open_backend(url)
+        return _backend
+
+
+def get_or_compute(backend, key, compute, ttl=None):
+    """``compute()`` once across processes; everyone else gets the stored result."""
+    value = backend.get(key)
+    if value is not None:
+        return value
+    with backend.lock(key):
+        value = backend.get(key)
+        if value is None:
+            value = compute()
+            backend.set(key, value, ttl)
+    return value
@@ -0,0 +1,126 @@
+"""Mergeable load histograms for distribution statistics over long ranges.
+
+A sketch counts the ``load`` samples of one bucket (an hour or a day) of
+one city's caches in fixed ``BIN_WIDTH`` bins, and keeps the exact
+maximum, the number of samples above ``OVERLOAD`` and the hosts that
+reported them. Adding the bins of two sketches gives exactly the sketch
+of their combined samples, so the distribution of any region, city and
+date range is a sum of stored sketches instead of a scan of raw ``cache``
+documents. Percentiles are read off the summed bins and are within one
+bin of the sample at that rank.
+
+Loads are bounded, so fixed bins stay small and, unlike a t-digest or KLL
+sketch, merge exactly and in any order.
+"""
+import numpy as np
+import pandas as pd
+
+BIN_WIDTH = 0.5
+# Loads at or above MAX_LOAD share the last bin; the maximum stays exact.
+MAX_LOAD = 200
+NBINS = int(MAX_LOAD / BIN_WIDTH)
+OVERLOAD = 100
+QUANTILES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99}
+FREQ = {'hourly': 'h', 'daily': 'D'}
+KEYS = ['timestamp', 'type', 'city', 'region']
+SUMMARY_COLUMNS = [*QUANTILES, 'max', 'samples', 'over', 'hosts_over']
+
+
+def bin_of(load):
+    return np.clip((np.asarray(load, dtype='float64') / BIN_WIDTH).astype(np.int64), 0, NBINS - 1)
+
+
+def sketch_docs(df, resolution):
+    """Sketch documents per bucket, type, city and region of raw ``cache`` rows."""
+    df = df[df['load'].notna()]
+    if df.empty:
+        return []
+    keys = pd.DataFrame({'timestamp': df['timestamp'].dt.floor(FREQ[resolution]),
+                         **{k: df[k].astype(object) for k in KEYS[1:]}})
+    group = keys.groupby(KEYS, sort=False, dropna=False).ngroup().to_numpy()
+    first = keys.drop_duplicates()
+    n = len(first)
+    load = df['load'].to_numpy(dtype='float64')
+
+    cells, counts = np.unique(group * NBINS + bin_of(load), return_counts=True)
+    cell_group, cell_bin = np.divmod(cells, NBINS)
+    bounds = np.searchsorted(cell_group, np.arange(n + 1))
+    maxima = np.full(n, -np.inf)
+    np.maximum.at(maxima, group, load)
+    over = load > OVERLOAD
+    over_counts = np.bincount(group[over], minlength=n)
+    hosts_over = (pd.DataFrame({'group': group[over], 'host': df['host'].to_numpy()[over]})
+                  .drop_duplicates().groupby('group')['host'].agg(list))
+
+    docs = []
+    for g, key in enumerate(first.itertuples(index=False)):
+        key = {'timestamp': key.timestamp.to_pydatetime(), 'type': key.type, 'city': key.city, 'region': key.region}
+        part = slice(bounds[g], bounds[g + 1])
+        docs.append({
+            '_id': key,
+            **key,
+            'bins': cell_bin[part].tolist(),
+            'counts': counts[part].tolist(),
+            'count': int(counts[part].sum()),
+            'max': float(maxima[g]),
+            'over': int(over_counts[g]),
+            'hosts_over': [str(h) for h in hosts_over.get(g, [])],
+        })
+    return docs
+
+
+def merge_bins(docs, rows=None, n_rows=1):
+    """Sum the bins of ``docs`` into ``n_rows`` histograms, doc ``i`` going to row ``rows[i]``."""
+    lengths = [len(d['bins']) for d in docs]
+    row = np.repeat(np.zeros(len(docs), dtype=np.int64) if rows is None else np.asarray(rows), lengths)
+    bins = np.fromiter((b for d in docs for b in d['bins']), dtype=np.int64, count=sum(lengths))
+    counts = np.fromiter((c for d in docs for c in d['counts']), dtype=np.float64, count=sum(lengths))
+    return np.bincount(row * NBINS + bins, weights=counts, minlength=n_rows * NBINS).reshape(n_rows, NBINS)
+
+
+def quantiles(hist, maxima, qs=QUANTILES):
+    """Quantiles of each row of ``hist``, interpolated within bins and capped at the row's maximum."""
+    cum = hist.cumsum(axis=1)
+    total = cum[:, -1]
+    rows = np.arange(len(hist))
+    out = {}
+    for name, q in qs.items():
+        target = q * total
+        b = np.minimum((cum < target[:, None]).sum(axis=1), NBINS - 1)
+        inside = hist[rows, b]
+        below = cum[rows, b] - inside
+        fraction = np.divide(target - below, inside, out=np.zeros_like(target), where=inside > 0)
+        value = np.minimum((b + fraction) * BIN_WIDTH, maxima)
+        out[name] = np.where(total > 0, value, np.nan)
+    return out
+
+
+def summarize(docs, by=None):
+    """Percentiles, maximum, sample count and overloaded samples and hosts of ``docs``.
+
+    Without ``by`` all docs are merged into one ``pd.Series``; with a key
+    such as ``'timestamp'`` the result is a frame with one merged row per
+    value of that key.
+    """
+    if by is None:
+        rows, labels = np.zeros(len(docs), dtype=np.int64), [None]
+    else:
+        rows, labels = pd.factorize(pd.Series([d[by] for d in docs]), sort=True)
+    n = len(labels)
+    hist = merge_bins(docs, rows, n)
+    maxima = np.full(n, -np.inf)
+    np.maximum.at(maxima, rows, np.array([d['max'] for d in docs], dtype='float64'))
+    hosts = [set() for _ in range(n)]
+    for r, d in zip(rows, docs):
+        hosts[r].update(d['hosts_over'])
+    frame = pd.DataFrame({
+        **quantiles(hist, maxima),
+        'max': np.where(np.isfinite(maxima), maxima, np.nan),
+        'samples': hist.sum(axis=1).astype(np.int64),
+        'over': np.bincount(rows, weights=[d['over'] for d in docs], minlength=n).astype(np.int64),
+        'hosts_over': [len(h) for h in hosts],
+    }, columns=SUMMARY_COLUMNS)
+    if by is None:
+        return frame.iloc[0]
+    frame.index = pd.Index(labels, name=by)
+    return frame
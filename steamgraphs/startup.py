@@ -0,0 +1,125 @@
+"""Cold start and rerun times of every page on synthetic data.
+
+Each page runs in a fresh interpreter, the way a new replica first
+serves it. The report has three timings per page:
+
+* ``imports`` is the time to run the page script's top-level imports.
+* ``first_run`` is the first run with empty caches: setup, queries and
+  charts.
+* ``rerun`` is the median of later runs with the same widget values.
+  It is what each widget change costs once the data is cached.
+
+Data comes from the generator in ``steamgraphs.bench``, in mongomock
+unless a local mongod is given, so compare timings only within one
+machine and backend::
+
+    python -m steamgraphs.startup --days 3 --reruns 5 --output startup.json
+"""
+import argparse
+import ast
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+PAGES = ['Home.py', *sorted(str(p) for p in Path('pages').glob('*.py'))]
+# Imported by the figure builders when needed; Streamlit itself already
+# imports plotly.graph_objects.
+LAZY_MODULES = ('plotly.express', 'plotly.subplots')
+
+
+def page_imports(path):
+    """Source of the top-level import statements of a page script."""
+    tree = ast.parse(Path(path).read_text(encoding='utf-8'))
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return ast.unparse(ast.Module(imports, type_ignores=[]))
+
+
+def measure_page(path, days=3.0, reruns=5, mongo_uri=None, rollups=False):
+    """Timings of ``path`` in this interpreter, which must not have imported the app yet."""
+    started = time.perf_counter()
+    exec(page_imports(path), {})
+    imports = time.perf_counter() - started
+    loaded = [name for name in LAZY_MODULES if name in sys.modules]
+
+    import streamlit.logger
+    from streamlit.testing.v1 import AppTest
+
+    from steamgraphs.bench import generate, open_database
+    from steamgraphs.db import use_database
+    from steamgraphs.rollups import update_rollups
+
+    streamlit.logger.set_log_level('error')
+    db = open_database(mongo_uri)
+    generate(db, days / 30)
+    if rollups:
+        update_rollups(db)
+    use_database(db)
+
+    app = AppTest.from_file(str(Path(path).resolve()), default_timeout=600)
+    started = time.perf_counter()
+    app.run()
+    first_run = time.perf_counter() - started
+    times = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        times.append(time.perf_counter() - started)
+    return {
+        'imports_seconds': round(imports, 4),
+        'first_run_seconds': round(first_run, 4),
+        'rerun_seconds': round(statistics.median(times), 4) if times else None,
+        'lazy_modules_on_import': loaded,
+        'errors': [str(e.value) for e in app.exception],
+    }
+
+
+def run_page(path, args):
+    """``measure_page`` in a child interpreter."""
+    command = [sys.executable, '-m', 'steamgraphs.startup', '--page', path,
+               '--days', str(args.days), '--reruns', str(args.reruns)]
+    if args.mongo_uri:
+        command += ['--mongo-uri', args.mongo_uri]
+    if args.rollups:
+        command.append('--rollups')
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=float, default=3.0, help='days of synthetic history')
+    parser.add_argument('--reruns', type=int, default=5)
+    parser.add_argument('--mongo-uri', help='local mongod to use instead of mongomock')
+    parser.add_argument('--rollups', action='store_true', help='build hourly/daily rollups first')
+    parser.add_argument('--page', help=argparse.SUPPRESS)
+    parser.add_argument('--output', default='startup.json')
+    args = parser.parse_args(argv)
+
+    if args.page:
+        print(json.dumps(measure_page(args.page, args.days, args.reruns, args.mongo_uri, args.rollups)))
+        return
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'page')},
+        'environment': {
+            'python': platform.python_version(),
+            'backend': 'mongod' if args.mongo_uri else 'mongomock',
+        },
+        'pages': {},
+    }
+    for path in PAGES:
+        stats = run_page(path, args)
+        report['pages'][path] = stats
+        print(f"{path:>45}: imports {stats['imports_seconds']:.3f}s, first run {stats['first_run_seconds']:.3f}s, "
+              f"rerun {stats['rerun_seconds']:.3f}s"
+              f"{''.join(f', imports {name}' for name in stats['lazy_modules_on_import'])}"
+              f"{', errors' if stats['errors'] else ''}")
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import pandas as pd
+import streamlit as st
+
+from steamgraphs import mirror
+from steamgraphs.db import get_db
+from steamgraphs.instrument import record_miss, timed
+from steamgraphs.live import MAX_TAILS, TAIL_TTL, Tail
+from steamgraphs.loader import load_frame
+from steamgraphs.range_cache import DAY, DayCache
+from steamgraphs.rollups import (BUCKET, FREQ, TRAFFIC, as_datetime, bucket_start, resolution_for, rollup_collection,
+                                 rollup_through)
+from steamgraphs.shared_cache import shared_backend
+
+
+@timed()
+@st.cache_data(ttl=600)
+@record_miss
+def traffic_bounds():
+    """``(first, last, regions)`` of ``global_bandwidth``, or ``None`` while it is empty.
+
+    Two single-document lookups on the timestamp index, for date pickers
+    that must not load the history to find its ends.
+    """
+    db = get_db()
+    first = db.global_bandwidth.find_one({}, {'_id': 0, 'timestamp': 1}, sort=[('timestamp', 1)])
+    last = db.global_bandwidth.find_one({}, {'_id': 0}, sort=[('timestamp', -1)])
+    if first is None:
+        return None
+    return first['timestamp'], last['timestamp'], [k for k in last if k != 'timestamp']
+
+
+def traffic_between(start, stop):
+    """Traffic with ``start <= timestamp < stop`` indexed by timestamp; mirrored days are read from disk."""
+    days, ranges = mirror.coverage(TRAFFIC, start, stop)
+    frames = []
+    mirrored = mirror.read(TRAFFIC, days) if days else pd.DataFrame()
+    if not mirrored.empty:
+        frames.append(mirrored.set_index('timestamp'))
+    for range_start, range_stop in ranges:
+        cursor = get_db().global_bandwidth.find({'timestamp': {'$gte': range_start, '$lt': range_stop}},
+                                                {'_id': 0}).sort('timestamp', 1)
+        frames.append(load_frame(cursor, {'timestamp': 'datetime'}, rest='float64', index='timestamp'))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    return frames[0] if len(frames) == 1 else pd.concat(frames)
+
+
+def _fetch_traffic_days(key, start, stop):
+    df = traffic_between(start, stop)
+    if df.empty:
+        return {}
+    return {day.date(): part for day, part in df.groupby(df.index.normalize())}
+
+
+@st.cache_resource
+def traffic_days():
+    return DayCache(_fetch_traffic_days, shared=shared_backend(), name='traffic')
+
+
+@timed()
+def traffic_window(start, end):
+    """Traffic from ``start`` to ``end`` inclusive, indexed by timestamp.
+
+    Built from per-day partials, so a first view only queries its own days
+    and widening the range later only fetches the days added.
+    """
+    parts = [p for p in traffic_days().get(TRAFFIC, as_datetime(start).date(), as_datetime(end).date()) if p is not None]
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts).loc[start:end]
+
+
+@st.cache_resource(max_entries=MAX_TAILS, ttl=TAIL_TTL, show_spinner=False)
+def traffic_tail(since, resolution):
+    """Traffic rows from ``since`` onwards, averaged into ``resolution``'s buckets above ``'raw'``."""
+    def fetch(start):
+        cursor = get_db().global_bandwidth.find({'timestamp': {'$gte': start}}, {'_id': 0}).sort('timestamp', 1)
+        df = load_frame(cursor, {'timestamp': 'datetime'}, rest='float64', index='timestamp')
+        if resolution != 'raw' and not df.empty:
+            df = df.groupby(df.index.floor(FREQ[resolution])).mean().rename_axis('timestamp')
+        return df.reset_index()
+
+    return Tail(fetch, since)
+
+
+@timed()
+def live_traffic(start, resolution):
+    """Traffic from ``start`` up to the newest sample, kept current by polling."""
+    return traffic_tail(as_datetime(start), resolution).rows().set_index('timestamp')
+
+
+@timed()
+@st.cache_data(ttl=600)
+@record_miss
+def traffic_rollup(start, end, resolution, through):
+    db = get_db()
+    items = list(db[rollup_collection(TRAFFIC, resolution)].find({'timestamp': {'$gte': start, '$lte': end, '$lt': through}},
+                                                                 {'_id': 0, 'timestamp': 1, 'mean': 1}).sort('timestamp', 1))
+    if len(items) == 0:
+        return pd.DataFrame()
+    index = pd.DatetimeIndex([x['timestamp'] for x in items], name='timestamp')
+    return pd.DataFrame([x['mean'] for x in items], index=index)
+
+
+@timed()
+def traffic_range(start, end, resolution=None):
+    """Regional traffic between ``start`` and ``end`` at a resolution fit for the span.
+
+    Above ``'raw'`` a row is the mean of a whole bucket, for every bucket
+    starting between ``start`` and ``end``. The rollup answers the range up
+    to its high-water mark; the rest, or all of it while the rollup has not
+    been built, is averaged from raw samples into the same buckets.
+    """
+    resolution = resolution or resolution_for(start, end)
+    if resolution == 'raw':
+        return traffic_window(start, end)
+    start, end = as_datetime(start), as_datetime(end)
+    through = rollup_through(get_db()[rollup_collection(TRAFFIC, resolution)])
+    parts = []
+    if through is not None and through > start:
+        parts.append(traffic_rollup(start, end, resolution, through))
+    if through is None or through <= end:
+        first = start if through is None else max(start, through)
+        if bucket_start(first, resolution) < first:
+            first = bucket_start(first, resolution) + BUCKET[resolution]
+        stop = bucket_start(end, resolution) + BUCKET[resolution]
+        raw = traffic_window(first, stop)
+        raw = raw[raw.index < stop] if not raw.empty else raw
+        if not raw.empty:
+            parts.append(raw.groupby(raw.index.floor(FREQ[resolution])).mean().rename_axis('timestamp'))
+    parts = [p for p in parts if not p.empty]
+    return pd.concat(parts) if parts else pd.DataFrame()
+
+
+@timed()
+@st.cache_data(ttl=600)
+@record_miss
+def get_latest_data():
+    db = get_db()
+    items = list(db.global_bandwidth.find({}, {'_id': 0}).sort([("timestamp", -1)]).limit(288))
+    return items
+
+
+@timed()
+@st.cache_data(ttl=600)
+@record_miss
+def get_traffic_data_date(start, end, region=None):
+    """Traffic from ``start`` through the day of ``end``, indexed by timestamp; only ``region``'s column if given."""
+    df = traffic_between(as_datetime(start), as_datetime(end) + DAY)
+    if region:
+        return df[[region]] if region in df.columns else pd.DataFrame(index=df.index)
+    return df
@@ -0,0 +1,83 @@
+"""The cache load heatmap against the pandas pivot it replaced."""
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from steamgraphs.cells import CELLS
+from steamgraphs.heatmap import origin_cache_counts, region_heatmap
+
+CACHES = sorted({c.city for c in CELLS.cells if c.cache})
+
+
+def pivot_heatmaps(items):
+    """The original page's pipeline."""
+    cell_id_to_region = {c.cell_id: {'city': c.city} for c in CELLS.cells}
+    region_to_city = {}
+    for c in CELLS.cells:
+        if c.cache:
+            region_to_city.setdefault(c.region, []).append(c.city)
+    df = pd.DataFrame(items)
+    df = df.groupby(['timestamp', 'query_id']).head(5)
+    df = df.groupby(['query_id', 'city']).size().unstack().fillna(0)
+    df.index = df.index.map(lambda x: cell_id_to_region[x]['city'])
+    df.sort_index(inplace=True)
+    region_dfs = {k: df[v] for k, v in region_to_city.items()}
+    for r in region_dfs:
+        region_dfs[r] = region_dfs[r].loc[(region_dfs[r] != 0).any(axis=1)]
+        region_dfs[r] = region_dfs[r].T
+        region_dfs[r] = region_dfs[r].reindex(index=region_dfs[r].index.union(region_dfs[r].columns), columns=region_dfs[r].index.union(region_dfs[r].columns), fill_value=0)
+        region_dfs[r] = region_dfs[r].sort_index(axis=1)
+        region_dfs[r] = region_dfs[r].sort_index(axis=0)
+    return region_dfs
+
+
+def fixture_items(origins, seed=0):
+    """Ranked cache entries for every origin cell, covering every cache city.
+
+    The last origin only queries at the start, so it misses most caches.
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime.datetime(2023, 1, 1)
+    items = []
+    for step in range(len(CACHES)):
+        timestamp = start + datetime.timedelta(minutes=5 * step)
+        for origin in origins if step < 3 else origins[:-1]:
+            ranked = np.roll(CACHES, -step)[:7]
+            for city in rng.permutation(ranked):
+                items.append({'timestamp': timestamp, 'query_id': origin, 'city': city})
+    return items
+
+
+def heatmaps(items):
+    df = pd.DataFrame(items)
+    counts = origin_cache_counts(df['timestamp'].to_numpy(), df['query_id'].to_numpy(), df['city'].to_numpy())
+    return {r: region_heatmap(counts, r) for r in CELLS.region_cache_codes}
+
+
+@pytest.mark.parametrize('origins', [[98, 175, 1, 2, 40, 50], [125, 176, 10, 20, 30, 150]])
+def test_matches_pivot(origins):
+    items = fixture_items(origins)
+    expected = pivot_heatmaps(items)
+    result = heatmaps(items)
+    assert set(expected) == {r for r in result if CELLS.region_cache_codes[r].size}
+    for region, frame in expected.items():
+        pd.testing.assert_frame_equal(result[region], frame, check_names=False)
+
+
+def test_keeps_a_column_per_cell():
+    cairo = [c.cell_id for c in CELLS.by_city['Cairo']]
+    assert len(cairo) == 2
+    items = fixture_items([*cairo, 1])
+    separate = [heatmaps([i for i in items if i['query_id'] == cell]) for cell in cairo]
+    both = heatmaps(items)
+    for region, frame in both.items():
+        if frame.empty:
+            continue
+        assert list(frame.columns).count('Cairo') == 2
+        assert list(frame.index) == list(frame.columns)
+        columns = frame.loc[:, frame.columns == 'Cairo'].to_numpy()
+        for i, heatmap in enumerate(separate):
+            column = heatmap[region]['Cairo'].reindex(frame.index.unique(), fill_value=0).to_numpy()
+            np.testing.assert_array_equal(columns[~frame.index.duplicated(), i], column)